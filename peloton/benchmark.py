@@ -0,0 +1,212 @@
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import mock_server
+
+
+# runs main.py and reports its peak rss on exit, counting the transform processes it has reaped
+_child_script = '''
+import os, resource, runpy, sys
+sys.argv = sys.argv[1:]
+sys.path.insert(0, os.path.dirname(sys.argv[0]))
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+finally:
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    sys.stderr.write(f'\\npeak_rss_kb={peak}\\n')
+'''
+
+# endpoints grouped into the stages of main.py, in pipeline order
+_stages = {
+    'login': ['login'],
+    'id paging': ['get_workouts'],
+    'workouts': ['get_workout', 'get_summary', 'get_performance_graph'],
+    'rides': ['get_ride', 'get_metadata_mappings'],
+    'instructors': ['get_instructor'],
+}
+
+
+def run_pipeline(total_workouts, latency_ms=0, error_rate=0.0, extra_env=None):
+
+    api = mock_server.MockPelotonApi(total_workouts, latency_ms=latency_ms, error_rate=error_rate)
+    server = mock_server.start_server(api)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ)
+        env.update({
+            'USERNAME': 'rider',
+            'PASSWORD': 'benchmark',
+            'PELOTON_BASE_URL': f'http://127.0.0.1:{server.server_address[1]}',
+            'SINK': 'local',
+            'LOCAL_SINK_PATH': os.path.join(workdir, 'output'),
+            'STATE_PATH': os.path.join(workdir, 'peloton_state.json'),
+            'CACHE_PATH': '',
+        })
+        env.update(extra_env or dict())
+
+        main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+        # run main.py in its own process so peak rss only covers the pipeline
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, '-c', _child_script, main_path], cwd=workdir, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        _, stderr = process.communicate()
+        elapsed = time.perf_counter() - start
+
+    server.shutdown()
+
+    if process.returncode != 0:
+        raise RuntimeError(f'main.py failed with exit code {process.returncode}:\n{stderr.decode()}')
+
+    # ru_maxrss is reported in kilobytes on linux
+    peak_rss_kb = int(stderr.decode().rsplit('peak_rss_kb=', 1)[1])
+    total_requests = sum(stats['count'] for stats in api.requests.values())
+    report = {
+        'workouts': total_workouts,
+        'latency_ms': latency_ms,
+        'error_rate': error_rate,
+        'seconds': round(elapsed, 3),
+        'workouts_per_second': round(total_workouts / elapsed, 1),
+        'requests': total_requests,
+        'requests_per_second': round(total_requests / elapsed, 1),
+        'bytes_received': api.bytes_sent,
+        'peak_rss_mb': round(peak_rss_kb / 1024, 1),
+        'stages': dict(),
+    }
+
+    # a stage runs from its first to its last request, whatever follows the last fetch is loading
+    last_request = None
+    for stage, endpoints in _stages.items():
+        stats = [api.requests[endpoint] for endpoint in endpoints if endpoint in api.requests]
+
+        if len(stats) > 0:
+            first = min(stat['first'] for stat in stats)
+            last = max(stat['last'] for stat in stats)
+            report['stages'][stage] = round(last - first, 3)
+            last_request = max(last_request or last, last)
+
+    if last_request is not None:
+        report['stages']['loads after fetch'] = round(start + elapsed - last_request, 3)
+
+    return report
+
+
+def _measure_bytes(build):
+
+    # traced python allocations still held by whatever build returns
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, size
+
+
+def measure_workout_memory(total_workouts=10000):
+
+    import peloton_workout
+
+    api = mock_server.MockPelotonApi(total_workouts)
+    workout_ids = [f'{0:08x}{index:024x}' for index in range(total_workouts)]
+
+    # parse the mock payloads directly, the workouts are never used to fetch so they need no user
+    def parse_workout(workout_id):
+        workout = peloton_workout.PelotonWorkout(None, workout_id)
+        workout.set_workout(api.get_workout(workout_id))
+        workout.set_workout_summary(api.get_summary(workout_id))
+        workout.set_workout_details(api.get_performance_graph(workout_id))
+
+        return workout
+
+    _, workout_bytes = _measure_bytes(lambda: [parse_workout(workout_id) for workout_id in workout_ids])
+    _, record_bytes = _measure_bytes(lambda: [parse_workout(workout_id).to_record() for workout_id in workout_ids])
+
+    return {
+        'workouts': total_workouts,
+        'workout_bytes_per_workout': round(workout_bytes / total_workouts),
+        'record_bytes_per_workout': round(record_bytes / total_workouts),
+    }
+
+
+def measure_import_time(modules=('main', 'peloton_workout', 'peloton_ride', 'peloton_instructor', 'peloton_user'), repeat=5):
+
+    # every import runs in a fresh interpreter, so nothing is already in sys.modules
+    code = 'import sys, time; start = time.perf_counter(); __import__(sys.argv[1]); print(time.perf_counter() - start)'
+    peloton_path = os.path.dirname(os.path.abspath(__file__))
+
+    report = dict()
+
+    for module in modules:
+        seconds = [float(subprocess.check_output([sys.executable, '-c', code, module], cwd=peloton_path)) for _ in range(repeat)]
+        report[f'import {module}'] = round(min(seconds) * 1000, 1)
+
+    # the whole cli start up for a dry run, including the interpreter itself
+    env = dict(os.environ, USERNAME='rider', PASSWORD='benchmark')
+    seconds = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(peloton_path, 'main.py'), 'sync', '--dry-run'], env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+        seconds.append(time.perf_counter() - start)
+
+    report['sync --dry-run'] = round(min(seconds) * 1000, 1)
+
+    return report
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark main.py against the mock Peloton API')
+    parser.add_argument('--workouts', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--max-workers', type=int, default=None)
+    parser.add_argument('--json', action='store_true', help='print one json report per run')
+    parser.add_argument('--memory', action='store_true', help='measure bytes held per parsed workout instead')
+    parser.add_argument('--imports', action='store_true', help='measure module import and cli start up times in milliseconds instead')
+    args = parser.parse_args()
+
+    if args.imports:
+        report = measure_import_time()
+
+        if args.json:
+            print(json.dumps(report))
+        else:
+            for name, milliseconds in report.items():
+                print(f'{name}: {milliseconds} ms')
+
+        sys.exit(0)
+
+    if args.memory:
+        for total_workouts in args.workouts:
+            report = measure_workout_memory(total_workouts)
+
+            if args.json:
+                print(json.dumps(report))
+            else:
+                print(f"{report['workouts']} workouts: {report['workout_bytes_per_workout']} bytes per PelotonWorkout, "
+                      f"{report['record_bytes_per_workout']} bytes per WorkoutRecord")
+
+        sys.exit(0)
+
+    extra_env = {'MAX_WORKERS': str(args.max_workers)} if args.max_workers else None
+
+    for total_workouts in args.workouts:
+        report = run_pipeline(total_workouts, args.latency_ms, args.error_rate, extra_env)
+
+        if args.json:
+            print(json.dumps(report))
+        else:
+            stages = ', '.join(f'{stage} {seconds}s' for stage, seconds in report['stages'].items())
+            print(f"{report['workouts']} workouts: {report['seconds']}s, {report['workouts_per_second']} workouts/s, "
+                  f"{report['requests_per_second']} requests/s, peak rss {report['peak_rss_mb']} MB ({stages})")
@@ -1,9 +1,10 @@
 import logging
 
-def setup_custom_logger(name):
+def setup_custom_logger(name, level=logging.DEBUG):
 
+    # debug messages are only formatted when the file log asks for them
     logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
+    logger.setLevel(min(level, logging.INFO))
     
     formatter = logging.Formatter(fmt='%(levelname)s - %(module)s - %(message)s')
 
@@ -13,7 +14,7 @@ def setup_custom_logger(name):
 
     file_handler = logging.FileHandler('peloton.log')
     file_handler.setFormatter(formatter)
-    file_handler.setLevel(logging.DEBUG)
+    file_handler.setLevel(level)
 
     logger.addHandler(console_handler)
     logger.addHandler(file_handler)
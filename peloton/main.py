@@ -1,152 +1,542 @@
-# To add a new cell, type '# %%'
-# To add a new markdown cell, type '# %% [markdown]'
-# %%
+import argparse
+import logging
 import os
 
-from google.cloud import bigquery
-from google.cloud import secretmanager
-import pandas as pd
-
 import log
-import peloton_instructor
-import peloton_user
-import peloton_ride
-import peloton_workout
 
-USERNAME=os.environ['USERNAME']
-GCP_PROJECT_ID=os.environ['GCP_PROJECT_ID']
-SECRET_MANAGER=os.environ['SECRET_MANAGER']
-BIGQUERY_DATASET=os.environ['BIGQUERY_DATASET']
 
-# configure logging
-logger = log.setup_custom_logger('peloton')
+# tables in the order a full sync loads them, each one needs the ids found by the one before it
+TABLES = ['users', 'workouts', 'rides', 'instructors']
+
+
+class Config:
+
+    # constructor
+    def __init__(self, environ=None):
+
+        environ = os.environ if environ is None else environ
+
+        self.sink = environ.get('SINK') or 'bigquery'
+        self.local_sink_path = environ.get('LOCAL_SINK_PATH') or 'output'
+        self.gcp_project_id = environ.get('GCP_PROJECT_ID')
+        self.bigquery_dataset = environ.get('BIGQUERY_DATASET')
+        self.max_workers = int(environ.get('MAX_WORKERS') or 16)
+        self.max_accounts = int(environ.get('MAX_ACCOUNTS') or 4)
+        self.global_max_workers = int(environ.get('GLOBAL_MAX_WORKERS') or 32)
+        self.incremental = environ.get('INCREMENTAL', '').lower() in ('1', 'true', 'yes')
+        self.state_path = environ.get('STATE_PATH') or 'peloton_state.json'
+        self.checkpoint_path = environ.get('CHECKPOINT_PATH', 'peloton_checkpoint.sqlite')
+        self.id_index_path = environ.get('ID_INDEX_PATH', 'peloton_index.sqlite')
+        self.cache_path = environ.get('CACHE_PATH', 'peloton_cache.sqlite')
+        self.cache_max_mb = int(environ.get('CACHE_MAX_MB') or 512)
+        self.catalog_path = environ.get('CATALOG_PATH') or 'peloton_catalog.json'
+        self.rate_limit = float(environ.get('RATE_LIMIT') or 0) or None
+        self.max_retries = int(environ.get('MAX_RETRIES') or 5)
+        self.batch_size = int(environ.get('BATCH_SIZE') or 5000)
+        self.metrics_batch_size = int(environ.get('METRICS_BATCH_SIZE') or 500)
+        self.parquet_compression = environ.get('PARQUET_COMPRESSION') or 'snappy'
+        self.parquet_row_group_size = int(environ.get('PARQUET_ROW_GROUP_SIZE') or 0) or None
+        self.log_level = environ.get('LOG_LEVEL') or 'INFO'
+        self.report_path = environ.get('REPORT_PATH', 'peloton_report.json')
+        self.prometheus_path = environ.get('PROMETHEUS_PATH')
+        self.transform_workers = int(environ.get('TRANSFORM_WORKERS') or 0)
+        self.archive_path = environ.get('ARCHIVE_PATH')
+        self.session_path = environ.get('SESSION_PATH', 'peloton_session.bin')
+        self.session_max_age = int(environ.get('SESSION_MAX_AGE') or 7 * 24 * 60 * 60)
+        self.session_key = environ.get('SESSION_KEY')
+
+
+    def get_table_id(self, table):
+
+        # the same ids the sinks use, without creating a bigquery client
+        if self.sink == 'local':
+            return table
+
+        return f'{self.gcp_project_id}.{self.bigquery_dataset}.{table}'
+
+
+class SyncRun:
+
+    # constructor
+    def __init__(self, config):
+
+        import peloton_telemetry
+        import peloton_transform
+
+        self.config = config
+        self.logger = logging.getLogger('peloton')
+
+        # request latencies, retries, cache hits, rows and stage times for the run report
+        self.telemetry = peloton_telemetry.get_telemetry()
+
+        # decoding and parsing workouts in worker processes, started before anything else starts threads
+        self.transform_pool = peloton_transform.TransformPool(config.transform_workers) if config.transform_workers > 0 else None
+
+        self.sink = None
+        self.users = None
+        self.cache = None
+        self.archive = None
+        self.scheduler = None
+        self.checkpoint = None
+        self.id_index = None
+        self.orchestrator = None
+
+        # ids found by one stage for the next, read back from the tables when that stage did not run
+        self.ride_ids = None
+        self.instructor_ids = None
+
+
+    def create_sink(self):
+
+        import peloton_sink
+
+        config = self.config
+
+        # initialize the sink, bigquery or a local directory of parquet files
+        if config.sink == 'local':
+            self.sink = peloton_sink.LocalSink(config.local_sink_path, compression=config.parquet_compression,
+                                               row_group_size=config.parquet_row_group_size)
+        else:
+            self.sink = peloton_sink.BigQuerySink(config.gcp_project_id, config.bigquery_dataset, compression=config.parquet_compression,
+                                                  row_group_size=config.parquet_row_group_size)
+
+
+    def start(self, tables=TABLES):
+
+        import peloton_archive
+        import peloton_auth
+        import peloton_cache
+        import peloton_checkpoint
+        import peloton_index
+        import peloton_pipeline
+        import peloton_scheduler
+        import peloton_secrets
+        import peloton_user
+
+        config = self.config
+
+        self.create_sink()
+
+        # one account from USERNAME, or every account listed in ACCOUNTS_PATH
+        accounts = peloton_secrets.load_accounts()
+
+        # an empty CACHE_PATH disables the response cache
+        self.cache = peloton_cache.ResponseCache(config.cache_path, max_bytes=config.cache_max_mb * 1024 * 1024) if config.cache_path else None
+
+        # raw responses are archived for offline replay when ARCHIVE_PATH is set
+        self.archive = peloton_archive.ResponseArchive(config.archive_path) if config.archive_path else None
+
+        # each account gets its own pooled session and client, while rate limit and request concurrency are shared by all of them
+        self.scheduler = peloton_scheduler.AccountScheduler(max_accounts=config.max_accounts, max_workers=config.global_max_workers,
+                                                            account_workers=config.max_workers, rate=config.rate_limit)
+
+        # logged in sessions are kept encrypted with SESSION_KEY between runs, so an account with a valid one never
+        # fetches its password; an empty SESSION_PATH or SESSION_KEY disables this
+        self.session_store = None
+
+        if config.session_path and config.session_key:
+            self.session_store = peloton_auth.SessionStore(config.session_path, config.session_key, max_age=config.session_max_age)
+
+        self.users = self.scheduler.map(lambda account: peloton_user.PelotonUser(account[0], get_password=account[1].get_password,
+                                                                                 client=self.scheduler.create_client(self.cache, config.max_retries,
+                                                                                                                     archive=self.archive),
+                                                                                 session_store=self.session_store),
+                                        accounts)
+
+        # loads run in the background while the next tables are fetched and are awaited together at the end
+        self.orchestrator = peloton_pipeline.LoadOrchestrator()
+
+        # a run that crashed is resumed, skipping every batch it already loaded; an empty CHECKPOINT_PATH disables this
+        self.checkpoint = peloton_checkpoint.CheckpointStore(config.checkpoint_path) if config.checkpoint_path else None
+
+        if self.checkpoint is not None:
+            self.checkpoint.start_run('sync' if list(tables) == TABLES else ','.join(tables))
+
+        # rides and instructors seen by earlier runs are never fetched again; an empty ID_INDEX_PATH disables this
+        self.id_index = peloton_index.IdIndex(config.id_index_path) if config.id_index_path else None
+
+
+    def get_load_target(self, table_id):
+
+        # with an index only never-seen rows are loaded, so they are appended; without one incremental runs
+        # stage rows and merge in only the new ones, and full runs replace the table
+        if self.id_index is not None:
+            return table_id, 'WRITE_APPEND', None
+        elif self.config.incremental:
+            return f'{table_id}_staging', 'WRITE_TRUNCATE', table_id
+        else:
+            return table_id, 'WRITE_TRUNCATE', None
+
+
+    def get_loaded_items(self, table_id):
+
+        return self.checkpoint.get_loaded_items(table_id) if self.checkpoint is not None else dict()
+
+
+    def sync_users(self):
+
+        import peloton_user
+
+        table_id = self.sink.get_table_id('users')
+
+        job = self.sink.load('users', table_id, peloton_user.PelotonUser.to_columns(self.users))
+
+        self.orchestrator.submit('users', job.result)
+
+
+    def sync_workouts(self):
+
+        import peloton_fetch
+        import peloton_metrics
+        import peloton_pipeline
+        import peloton_state
+        import peloton_workout
+
+        config = self.config
+
+        # stream every account's workouts in shared batches while they are still being fetched
+        state = peloton_state.SyncState(config.state_path)
+
+        table_id = self.sink.get_table_id('workouts')
+
+        if config.incremental:
+            state.seed([user.userid for user in self.users], self.sink, table_id)
+
+        write_disposition = 'WRITE_APPEND' if config.incremental else 'WRITE_TRUNCATE'
+
+        workout_loader = peloton_pipeline.BatchLoader(self.sink, 'workouts', table_id, peloton_workout.PelotonWorkout.to_columns,
+                                                      write_disposition=write_disposition, batch_size=config.batch_size, checkpoint=self.checkpoint,
+                                                      get_keys=lambda workout: (workout.workout_id, workout.ride_id))
+
+        # each workout carries thousands of samples, so metrics batches count far fewer workouts
+        metrics_table_id = self.sink.get_table_id('workout_metrics')
+
+        metrics_loader = peloton_pipeline.BatchLoader(self.sink, 'workout_metrics', metrics_table_id, peloton_metrics.to_columns,
+                                                      write_disposition=write_disposition, batch_size=config.metrics_batch_size,
+                                                      checkpoint=self.checkpoint, get_keys=lambda metrics: (metrics.workout_id, None))
+
+        # zones, normalized power, tss and best efforts are computed per metrics batch, one row per workout
+        training_table_id = self.sink.get_table_id('workout_training_metrics')
+
+        training_loader = peloton_pipeline.BatchLoader(self.sink, 'workout_training_metrics', training_table_id,
+                                                       peloton_metrics.to_training_columns, write_disposition=write_disposition,
+                                                       batch_size=config.metrics_batch_size, checkpoint=self.checkpoint,
+                                                       get_keys=lambda metrics: (metrics.workout_id, None))
+
+        # workouts loaded before a crash are skipped, but their rides are still needed
+        loaded_workouts = self.get_loaded_items(table_id)
+        loaded_metrics = self.get_loaded_items(metrics_table_id)
+        loaded_training = self.get_loaded_items(training_table_id)
+
+        def fetch_user_workouts(user):
+
+            # retrieve workout ids, only those newer than the last ingested workout when running incrementally
+            since_epoch = state.get_high_water_mark(user.userid) if config.incremental else None
+
+            workout_ids = user.iter_workout_ids(since_epoch=since_epoch, max_workers=config.max_workers)
+            workout_ids = (workout_id for workout_id in workout_ids
+                           if workout_id not in loaded_workouts or workout_id not in loaded_metrics or workout_id not in loaded_training)
+
+            ride_ids = dict()
+
+            workout_fetcher = peloton_fetch.WorkoutFetcher(user, max_workers=config.max_workers, transform_pool=self.transform_pool)
+
+            # only compact records are buffered until a batch is loaded, the parsed workouts are dropped right away
+            for workout, metrics in workout_fetcher.iter_records(workout_ids):
+                if workout.workout_id not in loaded_workouts:
+                    workout_loader.append(workout)
+                if workout.workout_id not in loaded_metrics:
+                    metrics_loader.append(metrics)
+                if workout.workout_id not in loaded_training:
+                    training_loader.append(metrics)
+                ride_ids[workout.ride_id] = None
+
+            return ride_ids
+
+        self.ride_ids = dict.fromkeys(loaded_workouts.values())
+
+        for ride_ids in self.scheduler.map(fetch_user_workouts, self.users):
+            self.ride_ids.update(ride_ids)
+
+        def finish_workout_load():
+
+            workout_loader.close()
+            metrics_loader.close()
+            training_loader.close()
+
+            # only move the high-water marks once every workout batch is in BigQuery
+            for user in self.users:
+                if user.latest_workout_epoch is not None:
+                    state.set_high_water_mark(user.userid, user.latest_workout_epoch, user.latest_workout_id)
+
+        self.orchestrator.submit('workouts', finish_workout_load)
+
+
+    def sync_rides(self):
+
+        import peloton_catalog
+        import peloton_fetch
+        import peloton_pipeline
+        import peloton_ride
+
+        config = self.config
+
+        # rides are shared by every account, so they are fetched once through the first one
+        user = self.users[0]
+
+        # without a workouts stage in this run, the rides to fetch come from the workouts table
+        if self.ride_ids is None:
+            self.ride_ids = dict.fromkeys(self.sink.get_ids(self.sink.get_table_id('workouts'), 'ride_id'))
+
+        table_id = self.sink.get_table_id('rides')
+
+        known_ride_ids = self.id_index.load(self.sink, table_id, 'ride_id') if self.id_index is not None else set()
+
+        ride_table_id, write_disposition, merge_table_id = self.get_load_target(table_id)
+
+        ride_loader = peloton_pipeline.BatchLoader(self.sink, 'rides', ride_table_id, peloton_ride.PelotonRide.to_columns,
+                                                   write_disposition=write_disposition, batch_size=config.batch_size,
+                                                   merge_table_id=merge_table_id, merge_key='ride_id',
+                                                   checkpoint=self.checkpoint, get_keys=lambda ride: (ride.ride_id, ride.instructor_id))
+
+        loaded_rides = self.get_loaded_items(ride_table_id)
+        self.instructor_ids = dict.fromkeys(loaded_rides.values())
+
+        ride_ids = [ride_id for ride_id in self.ride_ids if ride_id not in loaded_rides and ride_id not in known_ride_ids]
+
+        # ride types and the other metadata mappings are fetched at most once a day and looked up by id
+        catalog = peloton_catalog.MetadataCatalog(user.client, path=config.catalog_path)
+
+        with self.telemetry.stage('rides'):
+            for ride in peloton_fetch.imap(lambda ride_id: peloton_ride.PelotonRide(user, ride_id), ride_ids, config.max_workers):
+                ride.ride_type_display_name = catalog.get_display_name('class_types', ride.ride_type_id)
+
+                ride_loader.append(ride.to_record())
+                self.instructor_ids[ride.instructor_id] = None
+
+        def finish_ride_load():
+
+            ride_loader.close()
+
+            # only index rides once they are in the table
+            if self.id_index is not None:
+                self.id_index.add(self.sink, table_id, ride_ids + list(loaded_rides))
+
+        self.orchestrator.submit('rides', finish_ride_load)
+
+
+    def sync_instructors(self):
+
+        import peloton_fetch
+        import peloton_instructor
+        import peloton_pipeline
+
+        config = self.config
+
+        client = self.users[0].client
+
+        # without a rides stage in this run, the instructors to fetch come from the rides table
+        if self.instructor_ids is None:
+            self.instructor_ids = dict.fromkeys(self.sink.get_ids(self.sink.get_table_id('rides'), 'instructor_id'))
+
+        table_id = self.sink.get_table_id('instructors')
+
+        known_instructor_ids = self.id_index.load(self.sink, table_id, 'instructor_id') if self.id_index is not None else set()
+
+        instructor_table_id, write_disposition, merge_table_id = self.get_load_target(table_id)
+
+        instructor_loader = peloton_pipeline.BatchLoader(self.sink, 'instructors', instructor_table_id,
+                                                         peloton_instructor.PelotonInstructor.to_columns,
+                                                         write_disposition=write_disposition, batch_size=config.batch_size,
+                                                         merge_table_id=merge_table_id, merge_key='instructor_id', checkpoint=self.checkpoint,
+                                                         get_keys=lambda instructor: (instructor.instructor_id, None))
+
+        loaded_instructors = self.get_loaded_items(instructor_table_id)
+
+        instructor_ids = [instructor_id for instructor_id in self.instructor_ids
+                          if instructor_id is not None and instructor_id not in loaded_instructors and instructor_id not in known_instructor_ids]
+
+        with self.telemetry.stage('instructors'):
+            for instructor in peloton_fetch.imap(lambda instructor_id: peloton_instructor.PelotonInstructor(instructor_id, client=client),
+                                                 instructor_ids, config.max_workers):
+                instructor_loader.append(instructor.to_record())
+
+        def finish_instructor_load():
+
+            instructor_loader.close()
+
+            if self.id_index is not None:
+                self.id_index.add(self.sink, table_id, instructor_ids + list(loaded_instructors))
+
+        self.orchestrator.submit('instructors', finish_instructor_load)
+
+
+    def finish(self):
+
+        import peloton_session
+
+        config = self.config
+
+        timings = self.orchestrator.wait()
+
+        self.logger.info(f'Load timings: {timings}')
+
+        if self.checkpoint is not None:
+            self.checkpoint.complete_run()
+            self.checkpoint.close()
+
+        if self.id_index is not None:
+            self.id_index.close()
 
-# initialize bigquery
-client = bigquery.Client()
+        self.logger.info(f'Retried {sum(user.client.retries for user in self.users)} requests, '
+                         f'{sum(user.client.throttled for user in self.users)} of them throttled')
+        for user in self.users:
+            self.logger.info(f'Connection stats for {user.username}: {peloton_session.get_connection_stats(user.session)}')
 
-# initalize secret manager and access secret
-manager = secretmanager.SecretManagerServiceClient()
-name = manager.secret_version_path(GCP_PROJECT_ID, SECRET_MANAGER, 'latest')
-response = manager.access_secret_version(name)
-PASSWORD = response.payload.data.decode('UTF-8')
+        if self.cache is not None:
+            self.logger.info(f'Response cache stats: {self.cache.get_stats()}')
+            self.cache.close()
 
-# %% [markdown]
-# # Users
-# In the section below we create the Peloton user, authenticate with the API, and send user data to a table in BigQuery.
+        if self.archive is not None:
+            self.logger.info(f'Archived {self.archive.appended} responses, archive holds {self.archive.get_stats()}')
+            self.archive.close()
 
-# %%
+        # a machine readable report of the run, and optionally the same numbers for a prometheus textfile collector
+        if config.report_path:
+            self.telemetry.write_report(config.report_path)
+            self.logger.info(f'Wrote run report to {config.report_path}')
 
-user = peloton_user.PelotonUser(USERNAME, PASSWORD)
+        if config.prometheus_path:
+            self.telemetry.write_prometheus(config.prometheus_path)
 
+        if self.transform_pool is not None:
+            self.transform_pool.close()
 
-# %%
-table_id = f'{GCP_PROJECT_ID}.{BIGQUERY_DATASET}.users'
 
-job = client.load_table_from_dataframe(user.to_df(), table_id, job_config=user.get_bigquery_job_config())
+    def replay(self):
 
-job.result()
+        import peloton_archive
+        import peloton_fetch
+        import peloton_metrics
+        import peloton_pipeline
+        import peloton_transform
+        import peloton_workout
 
-# %% [markdown]
-# # Workouts
-# Here we retrieve all workout ids for the user, workout metadata, performance graphs that include heart rate data, and send to a table in BigQuery.
+        config = self.config
 
-# %%
-# retrieve all workout ids
-workout_ids = user.get_workout_ids()
+        if not config.archive_path:
+            raise ValueError('ARCHIVE_PATH must be set to replay archived responses')
 
-# create workout objects
-workouts = [peloton_workout.PelotonWorkout(user, workout_id) for workout_id in workout_ids]
+        self.create_sink()
+        archive = peloton_archive.ResponseArchive(config.archive_path)
 
-# get workout summaries
-summaries = [workout.get_workout_summary() for workout in workouts]
+        # the archive holds every workout fetched so far, so replay rebuilds the tables from scratch
+        workout_loader = peloton_pipeline.BatchLoader(self.sink, 'workouts', self.sink.get_table_id('workouts'),
+                                                      peloton_workout.PelotonWorkout.to_columns, batch_size=config.batch_size)
+        metrics_loader = peloton_pipeline.BatchLoader(self.sink, 'workout_metrics', self.sink.get_table_id('workout_metrics'),
+                                                      peloton_metrics.to_columns, batch_size=config.metrics_batch_size)
+        training_loader = peloton_pipeline.BatchLoader(self.sink, 'workout_training_metrics', self.sink.get_table_id('workout_training_metrics'),
+                                                       peloton_metrics.to_training_columns, batch_size=config.metrics_batch_size)
 
-# get workout details
-details = [workout.get_workout_details() for workout in workouts]
+        # training metrics need each rider's ftp, taken from their archived profile
+        ftps = dict()
 
+        def get_ftp(user_id):
 
-# %%
-# send workout data to BigQuery
+            if user_id not in ftps:
+                profile = archive.get('user', user_id, 'profile')
+                ftps[user_id] = peloton_transform.loads(profile)['cycling_ftp'] if profile is not None else None
 
-table_id = f'{GCP_PROJECT_ID}.{BIGQUERY_DATASET}.workouts'
+            return ftps[user_id]
 
-payload = pd.concat([workout.to_df() for workout in workouts])
+        def transform(item):
 
-job = client.load_table_from_dataframe(payload, table_id, job_config=workouts[0].get_bigquery_job_config())
+            workout_id, contents = item
 
-job.result()
+            if self.transform_pool is not None:
+                return self.transform_pool.submit(workout_id, contents).result()
 
+            return peloton_transform.transform_workout(workout_id, contents)
 
-# %%
-# send performance graph data to BigQuery
+        # parsing is the only work left, spread over the transform processes when there are any
+        items = archive.iter_entities('workout', ('workout', 'summary', 'performance_graph'))
 
-# table_id = f'{BIGQUERY_DATASET}.performance_graphs'
+        with self.telemetry.stage('replay'):
+            for workout, metrics in peloton_fetch.imap(transform, items, config.max_workers):
+                workout_loader.append(workout)
+                metrics_loader.append(metrics)
+                training_loader.append(metrics._replace(ftp=get_ftp(workout.user_id)))
 
-# job_config = bigquery.LoadJobConfig(
-#     schema=[
-#         bigquery.SchemaField('workout_id', 'STRING'),
-#         bigquery.SchemaField('display_name', 'STRING'),
-#         bigquery.SchemaField('range', 'STRING'),
-#         bigquery.SchemaField('minimum_value', 'INTEGER'),
-#         bigquery.SchemaField('maximum_value', 'INTEGER'),
-#         bigquery.SchemaField('duration_seconds', 'INTEGER'),
-#     ],
-#     write_disposition='WRITE_TRUNCATE'
-# )
+        workout_loader.close()
+        metrics_loader.close()
+        training_loader.close()
+        archive.close()
 
-# job = client.load_table_from_dataframe(performance_graph_df, table_id, job_config=job_config)
+        self.logger.info(f'Replayed {workout_loader.rows_loaded} archived workouts')
 
-# job.result()
+        if self.transform_pool is not None:
+            self.transform_pool.close()
 
-# %% [markdown]
-# # Rides
-# Here we retrieve class data for the class taken during the workout.
 
-# %%
-# pull rides data for list of unique ride ids
-ride_ids = [workout.ride_id for workout in workouts]
-unique_ride_ids = list(dict.fromkeys(ride_ids))
+    def run(self, tables):
 
-# create objects
-rides = [peloton_ride.PelotonRide(user, ride_id) for ride_id in unique_ride_ids]
+        self.start(tables)
 
-# fetch all possible ride types
-ride_types = rides[0].get_ride_types()
+        for table in tables:
+            getattr(self, f'sync_{table}')()
 
-for ride in rides:
-    ride_type = next((ride_type for ride_type in ride_types if ride_type['id'] == ride.ride_type_id), None)
-    ride.ride_type_display_name = ride_type['display_name']
+        self.finish()
 
 
-# %%
-table_id = f'{GCP_PROJECT_ID}.{BIGQUERY_DATASET}.rides'
+def describe(config, tables):
 
-payload = pd.concat([ride.to_df() for ride in rides])
+    import peloton_secrets
 
-job = client.load_table_from_dataframe(payload, table_id, job_config=rides[0].get_bigquery_job_config())
+    # what a run would do, without logging in, reading secrets or touching the sink
+    try:
+        accounts = ', '.join(username for username, _ in peloton_secrets.load_accounts())
+    except KeyError as e:
+        accounts = f'not configured, {e} is not set'
 
-job.result()
+    write_disposition = 'WRITE_APPEND' if config.incremental else 'WRITE_TRUNCATE'
 
-# %% [markdown]
-# # Instructors
+    lines = [
+        f'sink: {config.sink}' + (f' ({config.local_sink_path})' if config.sink == 'local' else ''),
+        f'accounts: {accounts}',
+        f'incremental: {config.incremental}',
+        f'workers: {config.max_workers} per account, {config.global_max_workers} overall, {config.transform_workers} transform processes',
+    ]
 
-# %%
-instructor_ids = [ride.instructor_id for ride in rides]
-unique_instructor_ids = list(dict.fromkeys(instructor_ids))
+    for table in tables:
+        lines.append(f'{table}: load into {config.get_table_id(table)}' + (f' ({write_disposition})' if table == 'workouts' else ''))
 
-instructors = [peloton_instructor.PelotonInstructor(instructor_id) for instructor_id in unique_instructor_ids if instructor_id is not None]
+    return '\n'.join(lines)
 
 
-# %%
-table_id = f'{GCP_PROJECT_ID}.{BIGQUERY_DATASET}.instructors'
+def main(argv=None):
 
-payload = pd.concat([instructor.to_df() for instructor in instructors])
+    parser = argparse.ArgumentParser(prog='peloton', description='Load Peloton users, workouts, rides and instructors into BigQuery')
+    parser.add_argument('command', nargs='?', default='sync', choices=['sync'] + TABLES + ['replay'],
+                        help='sync every table, or only the given one, or rebuild the workout tables from ARCHIVE_PATH (default: sync)')
+    parser.add_argument('--dry-run', action='store_true', help='print what would be loaded and exit')
+    args = parser.parse_args(argv)
 
-job = client.load_table_from_dataframe(payload, table_id, job_config=instructors[0].get_bigquery_job_config())
+    config = Config()
+    tables = TABLES if args.command == 'sync' else ['workouts'] if args.command == 'replay' else [args.command]
 
-job.result()
+    if args.dry_run:
+        print(describe(config, tables))
+        return
 
+    # configure logging, DEBUG writes every parsed field to peloton.log
+    log.setup_custom_logger('peloton', getattr(logging, config.log_level.upper()))
 
-# %%
+    if args.command == 'replay':
+        SyncRun(config).replay()
+    else:
+        SyncRun(config).run(tables)
 
 
+if __name__ == '__main__':
 
+    main()
@@ -0,0 +1,348 @@
+import argparse
+import email.utils
+import http.cookies
+import http.server
+import json
+import logging
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+
+
+# a synthetic peloton api, every entity is derived from its id so accounts of any size cost no memory
+class MockPelotonApi:
+
+    _epoch = 1600000000
+    _disciplines = ['cycling', 'running', 'strength', 'yoga', 'walking']
+    _class_types = [
+        {'id': f'{index:032x}', 'display_name': name}
+        for index, name in enumerate(['Climb', 'Intervals', 'Low Impact', 'Power Zone', 'Music', 'Tabata'])
+    ]
+
+    # constructor
+    def __init__(self, total_workouts=1000, latency_ms=0, error_rate=0.0, seed=0, require_session=False, session_ttl=30 * 24 * 60 * 60):
+
+        self.total_workouts = total_workouts
+        self.total_rides = max(1, total_workouts // 5)
+        self.total_instructors = 30
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.usernames = dict()
+        self.sessions = dict()
+        self.require_session = require_session
+        self.session_ttl = session_ttl
+        self.requests = dict()
+        self.bytes_sent = 0
+
+        self._lock = threading.Lock()
+        self._routes = [
+            ('POST', re.compile(r'^/auth/login$'), self.login),
+            ('GET', re.compile(r'^/api/me$'), self.get_me),
+            ('GET', re.compile(r'^/api/user/(\w+)/workouts$'), self.get_workouts),
+            ('GET', re.compile(r'^/api/workout/(\w+)$'), self.get_workout),
+            ('GET', re.compile(r'^/api/workout/(\w+)/summary$'), self.get_summary),
+            ('GET', re.compile(r'^/api/workout/(\w+)/performance_graph$'), self.get_performance_graph),
+            ('GET', re.compile(r'^/api/ride/metadata_mappings$'), self.get_metadata_mappings),
+            ('GET', re.compile(r'^/api/ride/(\w+)/details$'), self.get_ride),
+            ('GET', re.compile(r'^/api/instructor/(\w+)$'), self.get_instructor),
+        ]
+
+
+    def handle(self, method, path, query, body=None, session_id=None):
+
+        for route_method, pattern, handler in self._routes:
+            match = pattern.match(path)
+
+            if route_method == method and match:
+                endpoint = handler.__name__
+                break
+        else:
+            return 404, {'error': 'not found'}, None
+
+        # stamp every request so per-stage wall time can be derived afterwards
+        with self._lock:
+            stats = self.requests.setdefault(endpoint, {'count': 0, 'first': None, 'last': None})
+            stats['count'] += 1
+            stats['first'] = stats['first'] or time.perf_counter()
+            stats['last'] = time.perf_counter()
+            fail = self.random.random() < self.error_rate
+
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000)
+
+        if fail:
+            return 503, {'error': 'injected failure'}, {'Retry-After': '1'}
+
+        # login hands out a session cookie, every api call needs a live one when sessions are required
+        if endpoint == 'login':
+            session_id = uuid.uuid4().hex
+
+            with self._lock:
+                self.sessions[session_id] = (body['username_or_email'], time.time() + self.session_ttl)
+
+            expires = email.utils.formatdate(time.time() + self.session_ttl, usegmt=True)
+            payload = dict(handler(**body), session_id=session_id)
+
+            return 200, payload, {'Set-Cookie': f'peloton_session_id={session_id}; Path=/; Expires={expires}'}
+
+        with self._lock:
+            username, expires_at = self.sessions.get(session_id, (None, 0))
+
+        if expires_at < time.time() and (self.require_session or endpoint == 'get_me'):
+            return 401, {'error': 'unauthorized'}, None
+
+        if endpoint == 'get_me':
+            return 200, self.get_me(username), None
+
+        return 200, handler(*match.groups(), **query, **(body or dict())), None
+
+
+    def expire_sessions(self):
+
+        with self._lock:
+            self.sessions.clear()
+
+
+    def _pick(self, index, salt, count):
+
+        return (index * 2654435761 + salt) % count
+
+
+    def login(self, username_or_email, password):
+
+        user_data = self.get_me(username_or_email)
+
+        return {'user_id': user_data['id'], 'user_data': user_data}
+
+
+    def get_me(self, username):
+
+        # every username is its own account with its own workouts, rides and instructors are shared
+        with self._lock:
+            user_number = self.usernames.setdefault(username, len(self.usernames) + 1)
+
+        return {
+            'id': f'{user_number:032x}',
+            'cycling_ftp': 200,
+            'email': 'rider@example.com',
+            'last_workout_at': self._epoch,
+            'name': 'rider',
+            'last_name': 'Rider',
+            'first_name': 'Mock',
+            'gender': 'female',
+            'total_workouts': self.total_workouts,
+        }
+
+
+    def get_workouts(self, user_id, page='0', limit='100', **query):
+
+        start = int(page) * int(limit)
+        end = min(start + int(limit), self.total_workouts)
+
+        user_number = int(user_id, 16)
+
+        data = [{'id': f'{user_number:08x}{index:024x}', 'created_at': self._epoch - index * 3600, 'status': 'COMPLETE'} for index in range(start, end)]
+
+        return {'data': data, 'total': self.total_workouts, 'page': int(page), 'limit': int(limit)}
+
+
+    def get_workout(self, workout_id):
+
+        user_number = int(workout_id[:8], 16)
+        index = int(workout_id[8:], 16)
+        ride_index = self._pick(index, 1, self.total_rides)
+
+        return {
+            'id': workout_id,
+            'created_at': self._epoch - index * 3600,
+            'is_total_work_personal_record': index % 17 == 0,
+            'device_type': 'home_bike_v1',
+            'fitness_discipline': self._disciplines[ride_index % len(self._disciplines)],
+            'user_id': f'{user_number:032x}',
+            'status': 'COMPLETE',
+            'ride': self._get_ride_dict(ride_index),
+        }
+
+
+    def get_summary(self, workout_id):
+
+        index = int(workout_id, 16)
+
+        return {
+            'calories': 300 + index % 200,
+            'avg_heart_rate': 130 + index % 30,
+            'max_heart_rate': 170 + index % 20,
+            'avg_resistance': 40 + index % 20,
+            'max_resistance': 60 + index % 30,
+            'avg_speed': 18 + (index % 50) / 10,
+            'max_speed': 25 + (index % 50) / 10,
+            'total_work': 300000 + index * 7 % 100000,
+            'distance': 10 + (index % 100) / 10,
+        }
+
+
+    def get_performance_graph(self, workout_id):
+
+        index = int(workout_id, 16)
+        duration = 1800
+        every_n = 5
+        samples = duration // every_n
+        rng = random.Random(index)
+
+        def series(base, spread):
+            return [round(base + rng.uniform(-spread, spread), 1) for _ in range(samples)]
+
+        return {
+            'duration': duration,
+            'is_class_plan_shown': True,
+            'seconds_since_pedaling_start': list(range(0, duration, every_n)),
+            'average_summaries': [
+                {'display_name': 'Avg Pace', 'value': 7.5, 'slug': 'avg_pace'},
+            ],
+            'metrics': [
+                {'display_name': 'Output', 'slug': 'output', 'values': series(180, 60)},
+                {'display_name': 'Cadence', 'slug': 'cadence', 'values': series(85, 15)},
+                {'display_name': 'Resistance', 'slug': 'resistance', 'values': series(45, 10)},
+                {'display_name': 'Speed', 'slug': 'speed', 'values': series(19, 4)},
+                {
+                    'display_name': 'Heart Rate',
+                    'slug': 'heart_rate',
+                    'values': series(140, 25),
+                    'zones': [
+                        {'display_name': f'Zone {zone}', 'range': f'{zone * 20} - {zone * 20 + 20}',
+                         'min_value': zone * 20, 'max_value': zone * 20 + 20, 'duration': rng.randint(0, 600)}
+                        for zone in range(1, 6)
+                    ],
+                },
+            ],
+            'splits_data': {
+                'distance_marker_display_unit': 'mi',
+                'splits': [
+                    {'distance_marker': mile, 'seconds': 280 + rng.randint(0, 60), 'is_best': mile == 2}
+                    for mile in range(1, 6)
+                ],
+            },
+        }
+
+
+    def _get_ride_dict(self, ride_index):
+
+        return {
+            'id': f'{ride_index:032x}',
+            'instructor_id': f'{self._pick(ride_index, 2, self.total_instructors):032x}' if ride_index % 23 else None,
+            'ride_type_id': self._class_types[ride_index % len(self._class_types)]['id'],
+            'title': f'30 min Ride {ride_index}',
+            'description': 'A synthetic class for benchmarking.',
+            'duration': 1800,
+            'difficulty_estimate': 7.5,
+            'fitness_discipline': self._disciplines[ride_index % len(self._disciplines)],
+            'fitness_discipline_display_name': self._disciplines[ride_index % len(self._disciplines)].capitalize(),
+        }
+
+
+    def get_ride(self, ride_id):
+
+        return {'ride': self._get_ride_dict(int(ride_id, 16))}
+
+
+    def get_metadata_mappings(self):
+
+        return {
+            'class_types': self._class_types,
+            'device_types': [{'id': 'home_bike_v1', 'display_name': 'Bike'}, {'id': 'home_tread', 'display_name': 'Tread'}],
+            'fitness_disciplines': [{'id': discipline, 'name': discipline.capitalize()} for discipline in self._disciplines],
+        }
+
+
+    def get_instructor(self, instructor_id):
+
+        index = int(instructor_id, 16)
+
+        return {
+            'id': instructor_id,
+            'name': f'Instructor {index}',
+            'first_name': 'Instructor',
+            'last_name': str(index),
+            'spotify_playlist_uri': None,
+            'image_url': f'https://example.com/instructor/{index}.png',
+            'fitness_disciplines': self._disciplines[:2],
+        }
+
+
+class MockRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def _respond(self, method):
+
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length > 0 else None
+
+        cookies = http.cookies.SimpleCookie(self.headers.get('Cookie') or '')
+        session_id = cookies['peloton_session_id'].value if 'peloton_session_id' in cookies else None
+
+        status, payload, headers = self.server.api.handle(method, url.path, query, body, session_id)
+        body = json.dumps(payload).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or dict()).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+        with self.server.api._lock:
+            self.server.api.bytes_sent += len(body)
+
+
+    def do_GET(self):
+
+        self._respond('GET')
+
+
+    def do_POST(self):
+
+        self._respond('POST')
+
+
+    def log_message(self, format, *args):
+
+        logging.getLogger('peloton').debug(format % args)
+
+
+def start_server(api, host='127.0.0.1', port=0):
+
+    server = http.server.ThreadingHTTPServer((host, port), MockRequestHandler)
+    server.daemon_threads = True
+    server.api = api
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Serve a synthetic Peloton API')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workouts', type=int, default=1000)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = start_server(MockPelotonApi(args.workouts, args.latency_ms, args.error_rate), port=args.port)
+    print(f'Serving {args.workouts} workouts on http://127.0.0.1:{server.server_address[1]}')
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,238 @@
+import logging
+import mmap
+import os
+import re
+import sqlite3
+import threading
+import time
+import urllib.parse
+import zlib
+
+import zstandard
+
+
+class ResponseArchive:
+
+    # responses worth keeping for offline replay, as the kind and id of the entity and the part of it they hold
+    _archived_paths = [
+        (re.compile(r'^/api/workout/(\w+)$'), 'workout', 'workout'),
+        (re.compile(r'^/api/workout/(\w+)/summary$'), 'workout', 'summary'),
+        (re.compile(r'^/api/workout/(\w+)/performance_graph$'), 'workout', 'performance_graph'),
+        (re.compile(r'^/api/ride/(\w+)/details$'), 'ride', 'ride'),
+        (re.compile(r'^/api/instructor/(\w+)$'), 'instructor', 'instructor'),
+    ]
+
+    # constructor
+    def __init__(self, path, segment_bytes=256 * 1024 * 1024, commit_every=500):
+
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.commit_every = commit_every
+        # zstd compresses json better and faster than zlib; the codec is recorded per response, so archives
+        # written with zlib are still read
+        self.codec = 'zstd'
+        self.logger = logging.getLogger('peloton')
+        self.appended = 0
+
+        os.makedirs(self.path, exist_ok=True)
+
+        # responses are appended from the fetch threads, so share one connection and segment behind a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.path, 'index.sqlite'), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                kind TEXT NOT NULL,
+                id TEXT NOT NULL,
+                part TEXT NOT NULL,
+                segment INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                codec TEXT NOT NULL,
+                archived_at REAL NOT NULL,
+                PRIMARY KEY (kind, id, part)
+            )
+        ''')
+        self._conn.commit()
+
+        # writing continues in the last segment
+        self.segment = self._conn.execute('SELECT COALESCE(MAX(segment), 0) FROM responses').fetchone()[0]
+        self._file = open(self._get_segment_path(self.segment), 'ab')
+        self._pending = 0
+        self._maps = dict()
+
+
+    def _get_segment_path(self, segment):
+
+        return os.path.join(self.path, f'segment-{segment:05d}.bin')
+
+
+    def _get_key(self, url):
+
+        path = urllib.parse.urlsplit(url).path
+
+        for pattern, kind, part in self._archived_paths:
+            match = pattern.match(path)
+
+            if match:
+                return kind, match.group(1), part
+
+        return None
+
+
+    def _compress(self, content):
+
+        return zstandard.ZstdCompressor(level=3).compress(content)
+
+
+    def _decompress(self, blob, codec):
+
+        if codec == 'zstd':
+            return zstandard.ZstdDecompressor().decompress(blob)
+
+        return zlib.decompress(blob)
+
+
+    def append(self, url, content):
+
+        key = self._get_key(url)
+
+        if key is None:
+            return False
+
+        self.put(*key, content)
+
+        return True
+
+
+    def is_missing(self, url):
+
+        key = self._get_key(url)
+
+        if key is None:
+            return False
+
+        with self._lock:
+            row = self._conn.execute('SELECT 1 FROM responses WHERE kind = ? AND id = ? AND part = ?', key).fetchone()
+
+        return row is None
+
+
+    def put(self, kind, id, part, content):
+
+        blob = self._compress(content)
+
+        with self._lock:
+            # segments are never rewritten, a new one is started once the current one is full
+            if self._file.tell() + len(blob) > self.segment_bytes and self._file.tell() > 0:
+                self._file.close()
+                self.segment += 1
+                self._file = open(self._get_segment_path(self.segment), 'ab')
+
+            offset = self._file.tell()
+            self._file.write(blob)
+
+            # an archived response replaces the older copy in the index, the older bytes stay in their segment
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (kind, id, part, segment, offset, length, codec, archived_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (kind, id, part, self.segment, offset, len(blob), self.codec, time.time())
+            )
+
+            self.appended += 1
+            self._pending += 1
+
+            # the segment is flushed before its index rows are committed, so the index never points past the data
+            if self._pending >= self.commit_every:
+                self._commit()
+
+
+    def _commit(self):
+
+        self._file.flush()
+        self._conn.commit()
+        self._pending = 0
+
+
+    def _read(self, segment, offset, length, codec):
+
+        # segments are memory mapped once and remapped only while the current one is still growing
+        mapped = self._maps.get(segment)
+
+        if mapped is None or offset + length > len(mapped):
+            if segment == self.segment:
+                self._file.flush()
+
+            if mapped is not None:
+                mapped.close()
+
+            with open(self._get_segment_path(segment), 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            self._maps[segment] = mapped
+
+        return self._decompress(mapped[offset:offset + length], codec)
+
+
+    def get(self, kind, id, part):
+
+        with self._lock:
+            row = self._conn.execute('SELECT segment, offset, length, codec FROM responses WHERE kind = ? AND id = ? AND part = ?',
+                                     (kind, id, part)).fetchone()
+
+            if row is None:
+                return None
+
+            return self._read(*row)
+
+
+    def iter_entities(self, kind, parts):
+
+        with self._lock:
+            self._commit()
+            rows = self._conn.execute(
+                'SELECT id, part, segment, offset, length, codec FROM responses WHERE kind = ? ORDER BY id, part',
+                (kind,)
+            ).fetchall()
+
+        # one dict of raw responses per entity that has every requested part
+        contents = dict()
+        current_id = None
+        skipped = 0
+
+        for id, part, segment, offset, length, codec in rows + [(None, None, None, None, None, None)]:
+            if id != current_id:
+                if current_id is not None:
+                    if all(part in contents for part in parts):
+                        yield current_id, contents
+                    else:
+                        skipped += 1
+
+                contents = dict()
+                current_id = id
+
+            if part in parts:
+                with self._lock:
+                    contents[part] = self._read(segment, offset, length, codec)
+
+        if skipped > 0:
+            self.logger.warning(f'Skipped {skipped} archived {kind} entities missing one of {", ".join(parts)}')
+
+
+    def get_stats(self):
+
+        with self._lock:
+            rows = self._conn.execute('SELECT kind, COUNT(*), SUM(length) FROM responses GROUP BY kind').fetchall()
+
+        return {kind: {'responses': count, 'bytes': size} for kind, count, size in rows}
+
+
+    def close(self):
+
+        with self._lock:
+            self._commit()
+            self._file.close()
+            self._conn.close()
+
+            for mapped in self._maps.values():
+                mapped.close()
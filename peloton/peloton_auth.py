@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from cryptography.fernet import Fernet, InvalidToken
+
+import peloton_util
+
+
+class SessionStore:
+
+    # constructor
+    def __init__(self, path, key, max_age=7 * 24 * 60 * 60):
+
+        self.path = path
+        self.max_age = max_age
+        self.logger = logging.getLogger('peloton')
+        self._lock = threading.Lock()
+
+        # the key is never stored next to the sessions, so the file is only readable with SESSION_KEY
+        self.fernet = Fernet(key)
+
+
+    def _read(self):
+
+        if not os.path.exists(self.path):
+            return dict()
+
+        with open(self.path, 'rb') as f:
+            token = f.read()
+
+        # a file written under another key is treated as empty and overwritten by the next login
+        try:
+            return json.loads(self.fernet.decrypt(token))
+        except InvalidToken:
+            self.logger.warning(f'Could not decrypt sessions in {self.path}, logging in again')
+            return dict()
+
+
+    def _write(self, sessions):
+
+        # readable by its owner only, even though it is encrypted
+        peloton_util.write_atomic(self.path, self.fernet.encrypt(json.dumps(sessions).encode('utf-8')), mode=0o600)
+
+
+    def load(self, username):
+
+        with self._lock:
+            stored = self._read().get(username)
+
+        if stored is None:
+            return None
+
+        if stored['expires_at'] <= time.time():
+            self.logger.info(f'Stored session for {username} has expired')
+            return None
+
+        return stored
+
+
+    def save(self, username, session, user_id):
+
+        cookies = [{'name': cookie.name, 'value': cookie.value, 'domain': cookie.domain, 'path': cookie.path,
+                    'expires': cookie.expires, 'secure': cookie.secure} for cookie in session.cookies]
+
+        # a session is trusted until its first cookie expires, and never for longer than max_age
+        saved_at = time.time()
+        expires_at = min([saved_at + self.max_age] + [cookie['expires'] for cookie in cookies if cookie['expires']])
+
+        with self._lock:
+            sessions = self._read()
+            sessions[username] = {
+                'cookies': cookies,
+                'user_id': user_id,
+                'saved_at': saved_at,
+                'expires_at': expires_at,
+            }
+            self._write(sessions)
+
+        self.logger.debug('Saved session for %s until %s', username, expires_at)
+
+
+    def delete(self, username):
+
+        with self._lock:
+            sessions = self._read()
+
+            if sessions.pop(username, None) is not None:
+                self._write(sessions)
+
+
+def restore_cookies(session, stored):
+
+    for cookie in stored['cookies']:
+        session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'], path=cookie['path'],
+                            expires=cookie['expires'], secure=cookie['secure'])
@@ -0,0 +1,157 @@
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+
+class ResponseCache:
+
+    # seconds a payload stays fresh per endpoint, None means it never expires
+    # endpoints that match no policy (e.g. workout list pages) are never cached
+    _ttl_policies = [
+        (re.compile(r'/api/instructor/[^/?]+$'), None),
+        (re.compile(r'/api/ride/metadata_mappings$'), 24 * 60 * 60),
+        (re.compile(r'/api/ride/[^/?]+/details$'), None),
+        (re.compile(r'/api/workout/[^/?]+(/summary|/performance_graph)?$'), None),
+        (re.compile(r'/api/(me|user/[^/?]+)$'), 5 * 60),
+    ]
+
+    # constructor
+    def __init__(self, path, max_bytes=512 * 1024 * 1024):
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.logger = logging.getLogger('peloton')
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # fetches run on worker threads, so share one connection behind a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                payload BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL,
+                accessed_at REAL NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+        self._conn.commit()
+
+        self.total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+        self.logger.debug('Opened response cache %s holding %s bytes', self.path, self.total_bytes)
+
+
+    def get_ttl(self, url):
+
+        for pattern, ttl in self._ttl_policies:
+            if pattern.search(url):
+                return True, ttl
+
+        return False, None
+
+
+    def get(self, url):
+
+        content = self.get_content(url)
+
+        return None if content is None else json.loads(content)
+
+
+    def get_content(self, url):
+
+        # the stored json bytes, for callers that decode payloads themselves
+        cacheable, ttl = self.get_ttl(url)
+
+        if not cacheable:
+            return None
+
+        now = time.time()
+
+        with self._lock:
+            row = self._conn.execute('SELECT payload, expires_at FROM responses WHERE url = ?', (url,)).fetchone()
+
+            if row is None or (row[1] is not None and row[1] < now):
+                self.misses += 1
+                return None
+
+            self._conn.execute('UPDATE responses SET accessed_at = ? WHERE url = ?', (now, url))
+            self.hits += 1
+
+        return zlib.decompress(row[0])
+
+
+    def set(self, url, payload):
+
+        self.set_content(url, json.dumps(payload).encode('utf-8'))
+
+
+    def set_content(self, url, content):
+
+        cacheable, ttl = self.get_ttl(url)
+
+        if not cacheable:
+            return
+
+        now = time.time()
+        expires_at = None if ttl is None else now + ttl
+        blob = zlib.compress(content)
+
+        with self._lock:
+            old = self._conn.execute('SELECT size FROM responses WHERE url = ?', (url,)).fetchone()
+            if old is not None:
+                self.total_bytes -= old[0]
+
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (url, payload, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+                (url, blob, len(blob), expires_at, now)
+            )
+            self.total_bytes += len(blob)
+
+            self._evict()
+            self._conn.commit()
+
+
+    def _evict(self):
+
+        # drop least recently used payloads until the cache fits in max_bytes again
+        while self.total_bytes > self.max_bytes:
+            rows = self._conn.execute('SELECT url, size FROM responses ORDER BY accessed_at LIMIT 100').fetchall()
+
+            if len(rows) == 0:
+                break
+
+            for url, size in rows:
+                self._conn.execute('DELETE FROM responses WHERE url = ?', (url,))
+                self.total_bytes -= size
+                self.evictions += 1
+
+                if self.total_bytes <= self.max_bytes:
+                    break
+
+
+    def get_stats(self):
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'bytes': self.total_bytes
+        }
+
+
+    def close(self):
+
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
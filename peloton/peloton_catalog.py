@@ -0,0 +1,91 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import peloton_util
+
+
+class MetadataCatalog:
+
+    _base_url = peloton_util.BASE_URL
+
+    # constructor
+    def __init__(self, client, path=None, ttl=24 * 60 * 60):
+
+        self.client = client
+        self.path = path
+        self.ttl = ttl
+        self.logger = logging.getLogger('peloton')
+        self.mappings = None
+
+        self._lock = threading.Lock()
+
+
+    def _read(self):
+
+        if self.path is None or not os.path.exists(self.path):
+            return None
+
+        with open(self.path) as f:
+            cached = json.load(f)
+
+        if time.time() - cached['fetched_at'] > self.ttl:
+            self.logger.debug('Metadata catalog %s is older than %ss', self.path, self.ttl)
+            return None
+
+        return cached['payload']
+
+
+    def _write(self, payload):
+
+        if self.path is None:
+            return
+
+        peloton_util.write_atomic(self.path, json.dumps({'fetched_at': time.time(), 'payload': payload}))
+
+
+    def load(self):
+
+        with self._lock:
+            if self.mappings is not None:
+                return self.mappings
+
+            payload = self._read()
+
+            if payload is None:
+                payload = self.client.get_json(f'{self._base_url}/api/ride/metadata_mappings')
+
+                if payload is None:
+                    logging.error('Failed to fetch metadata mappings')
+                    raise ValueError('Failed to fetch metadata mappings')
+
+                self._write(payload)
+                self.logger.info('Fetched metadata mappings')
+
+            # index every mapping family that is a list of entries with ids, e.g. class_types or device_types
+            self.mappings = dict()
+
+            for family, entries in payload.items():
+                if isinstance(entries, list) and all(isinstance(entry, dict) and 'id' in entry for entry in entries):
+                    self.mappings[family] = {entry['id']: entry for entry in entries}
+
+            self.logger.debug('Indexed metadata mapping families %s', list(self.mappings))
+
+        return self.mappings
+
+
+    def get(self, family, id):
+
+        return self.load().get(family, dict()).get(id)
+
+
+    def get_display_name(self, family, id):
+
+        entry = self.get(family, id)
+
+        if entry is None:
+            return None
+
+        return entry.get('display_name') or entry.get('name')
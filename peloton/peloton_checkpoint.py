@@ -0,0 +1,138 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class CheckpointStore:
+
+    # constructor
+    def __init__(self, path):
+
+        self.path = path
+        self.logger = logging.getLogger('peloton')
+        self.run_id = None
+        self.resumed = False
+
+        # batches are recorded from loader threads, so share one connection behind a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                scope TEXT NOT NULL DEFAULT 'sync',
+                started_at REAL NOT NULL,
+                completed_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS batches (
+                run_id TEXT NOT NULL,
+                table_id TEXT NOT NULL,
+                batch INTEGER NOT NULL,
+                num_rows INTEGER NOT NULL,
+                PRIMARY KEY (run_id, table_id, batch)
+            );
+            CREATE TABLE IF NOT EXISTS items (
+                run_id TEXT NOT NULL,
+                table_id TEXT NOT NULL,
+                item_id TEXT NOT NULL,
+                child_id TEXT,
+                PRIMARY KEY (run_id, table_id, item_id)
+            );
+        ''')
+
+        # checkpoints written before runs had a scope all belong to full syncs
+        if 'scope' not in [column[1] for column in self._conn.execute('PRAGMA table_info(runs)')]:
+            self._conn.execute("ALTER TABLE runs ADD COLUMN scope TEXT NOT NULL DEFAULT 'sync'")
+
+        self._conn.commit()
+
+
+    def start_run(self, scope='sync'):
+
+        # resume the last run of the same scope that never completed, otherwise start a fresh one; a single table
+        # command never resumes or completes a crashed full sync
+        row = self._conn.execute('SELECT run_id FROM runs WHERE scope = ? AND completed_at IS NULL ORDER BY started_at DESC LIMIT 1',
+                                 (scope,)).fetchone()
+
+        if row is not None:
+            self.run_id = row[0]
+            self.resumed = True
+            self.logger.info(f'Resuming run {self.run_id}')
+        else:
+            self.run_id = uuid.uuid4().hex
+            self.resumed = False
+
+            with self._lock:
+                self._conn.execute('INSERT INTO runs (run_id, scope, started_at) VALUES (?, ?, ?)', (self.run_id, scope, time.time()))
+                self._conn.commit()
+
+            self.logger.info(f'Starting run {self.run_id}')
+
+        return self.run_id
+
+
+    def get_job_id(self, table_id, keys):
+
+        # the job id is derived from the keys of the batch, so a resumed batch only reuses a job that loaded the
+        # same items; new workouts or another account order produce a different batch and a new job
+        safe_table_id = ''.join(c if c.isalnum() else '_' for c in table_id)
+        digest = hashlib.sha256('\n'.join(sorted(f'{item_id}:{child_id}' for item_id, child_id in keys)).encode('utf-8')).hexdigest()
+
+        return f'peloton_{self.run_id}_{safe_table_id}_{digest[:32]}'
+
+
+    def get_batches(self, table_id):
+
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(num_rows), 0) FROM batches WHERE run_id = ? AND table_id = ?',
+                (self.run_id, table_id)
+            ).fetchone()
+
+        return row[0], row[1]
+
+
+    def get_loaded_items(self, table_id):
+
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT item_id, child_id FROM items WHERE run_id = ? AND table_id = ?',
+                (self.run_id, table_id)
+            ).fetchall()
+
+        return dict(rows)
+
+
+    def record_batch(self, table_id, batch, keys, num_rows):
+
+        # keys are (item id, child id) pairs, e.g. a workout and the ride it was taken on
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO batches (run_id, table_id, batch, num_rows) VALUES (?, ?, ?, ?)',
+                (self.run_id, table_id, batch, num_rows)
+            )
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO items (run_id, table_id, item_id, child_id) VALUES (?, ?, ?, ?)',
+                [(self.run_id, table_id, item_id, child_id) for item_id, child_id in keys]
+            )
+            self._conn.commit()
+
+        self.logger.debug('Checkpointed batch %s of %s with %s rows', batch, table_id, num_rows)
+
+
+    def complete_run(self):
+
+        with self._lock:
+            self._conn.execute('UPDATE runs SET completed_at = ? WHERE run_id = ?', (time.time(), self.run_id))
+            self._conn.execute('DELETE FROM items WHERE run_id = ?', (self.run_id,))
+            self._conn.commit()
+
+        self.logger.info(f'Completed run {self.run_id}')
+
+
+    def close(self):
+
+        with self._lock:
+            self._conn.close()
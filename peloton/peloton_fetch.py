@@ -0,0 +1,92 @@
+import collections
+import concurrent.futures
+import logging
+
+import peloton_telemetry
+import peloton_workout
+
+
+def imap(func, items, max_workers=16):
+
+    pending = collections.deque()
+
+    # pull items lazily and keep a bounded window of calls in flight, yielding results in input order
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for item in items:
+                pending.append(executor.submit(func, item))
+
+                if len(pending) >= max_workers * 2:
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+class WorkoutFetcher:
+
+    # constructor
+    def __init__(self, peloton_user, max_workers=16, parts=('workout', 'summary', 'performance_graph'), transform_pool=None):
+
+        self.peloton_user = peloton_user
+        self.max_workers = max_workers
+        self.parts = parts
+        self.transform_pool = transform_pool
+        self.logger = logging.getLogger('peloton')
+
+
+    def _fetch_workout(self, workout_id):
+
+        workout = peloton_workout.PelotonWorkout(self.peloton_user, workout_id)
+
+        # only the endpoints the caller needs are fetched, anything else is fetched lazily on access
+        with peloton_telemetry.get_telemetry().stage('workout hydrate'):
+            for part in self.parts:
+                workout.hydrate_part(part)
+
+        return workout
+
+
+    def _fetch_record(self, workout_id):
+
+        if self.transform_pool is None:
+            workout = self._fetch_workout(workout_id)
+            return workout.to_record(), workout.metrics
+
+        client = self.peloton_user.client
+        urls = {part: peloton_workout.PelotonWorkout.get_part_url(workout_id, part) for part in ('workout', 'summary', 'performance_graph')}
+
+        contents = dict()
+        fetched = list()
+
+        # raw bytes are fetched here and decoded in a worker process, away from the gil; the fetch is timed as the
+        # hydrate stage, like on the serial path
+        with peloton_telemetry.get_telemetry().stage('workout hydrate'):
+            for part, url in urls.items():
+                contents[part] = client.get_cached_content(url)
+
+                if contents[part] is None:
+                    contents[part] = client.get_content(url, use_cache=False)
+                    fetched.append(part)
+
+                if contents[part] is None:
+                    raise ValueError(f'Failed to fetch {part} for workout id {workout_id}')
+
+        with peloton_telemetry.get_telemetry().stage('workout transform'):
+            record, metrics = self.transform_pool.submit(workout_id, contents).result()
+
+        # as with parsed payloads, only finished workouts are cached
+        if client.cache is not None and record.status == 'COMPLETE':
+            for part in fetched:
+                client.cache.set_content(urls[part], contents[part])
+
+        return record, metrics._replace(ftp=self.peloton_user.cycling_ftp)
+
+
+    def iter_records(self, workout_ids):
+
+        # compact records and metric arrays, decoded by the transform pool when there is one
+        return imap(self._fetch_record, workout_ids, self.max_workers)
@@ -0,0 +1,308 @@
+import email.utils
+import json
+import logging
+import random
+import threading
+import time
+
+import requests
+
+import peloton_session
+import peloton_telemetry
+
+
+class TokenBucket:
+
+    # constructor
+    def __init__(self, rate, capacity=None):
+
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+
+    def acquire(self):
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+class AdaptiveLimiter:
+
+    # constructor
+    def __init__(self, min_limit=1, max_limit=16, cooldown=1.0):
+
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self.in_flight = 0
+        self.cooldown = cooldown
+        self._decreased_at = 0
+        self._condition = threading.Condition()
+
+
+    def acquire(self):
+
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+
+            self.in_flight += 1
+
+
+    def release(self, throttled=False):
+
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+
+            # additive increase of one slot per window of successes, multiplicative decrease on throttling
+            if throttled:
+                if now - self._decreased_at > self.cooldown:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self._decreased_at = now
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+            self._condition.notify_all()
+
+
+class PelotonClient:
+
+    _retry_status_codes = (429, 500, 502, 503, 504)
+
+    # constructor
+    def __init__(self, session=None, cache=None, rate=None, max_retries=5, backoff=0.5, max_backoff=30,
+                 min_concurrency=1, max_concurrency=16, bucket=None, global_limiter=None, archive=None):
+
+        self.session = session or peloton_session.create_session(max_concurrency)
+        self.cache = cache
+        self.archive = archive
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.logger = logging.getLogger('peloton')
+        self.retries = 0
+        self.throttled = 0
+        self.telemetry = peloton_telemetry.get_telemetry()
+
+        # a shared bucket and global limiter cap many clients together, e.g. one per account
+        self.bucket = bucket or (TokenBucket(rate) if rate else None)
+        self.limiter = AdaptiveLimiter(min_concurrency, max_concurrency)
+        self.global_limiter = global_limiter
+
+        self._blocked_until = 0
+
+        # called to log in again when a request comes back 401, once per expired session however many requests saw it
+        self.reauthenticate = None
+        self._auth_generation = 0
+        self._auth_lock = threading.Lock()
+
+
+    def _get_retry_after(self, resp):
+
+        value = resp.headers.get('Retry-After')
+
+        if value is None:
+            return None
+
+        if value.isdigit():
+            return int(value)
+
+        # Retry-After may also be an http date, a malformed one falls back to the backoff delay
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            self.logger.debug('Ignoring malformed Retry-After %s', value)
+            return None
+
+        return max(0, retry_at.timestamp() - time.time())
+
+
+    def _wait_turn(self):
+
+        # a Retry-After from any request pauses every request until it has passed
+        delay = self._blocked_until - time.monotonic()
+
+        if delay > 0:
+            time.sleep(delay)
+
+        if self.bucket is not None:
+            self.bucket.acquire()
+
+
+    def _renew_auth(self, generation):
+
+        with self._auth_lock:
+            if generation == self._auth_generation:
+                self.logger.info('Session expired, logging in again')
+                self.reauthenticate()
+                self._auth_generation += 1
+
+
+    def request(self, method, url, retry_auth=True, **kwargs):
+
+        attempt = 0
+
+        while True:
+            generation = self._auth_generation
+            self._wait_turn()
+            self.limiter.acquire()
+
+            resp = None
+            error = None
+
+            if self.global_limiter is not None:
+                self.global_limiter.acquire()
+
+            start = time.perf_counter()
+
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                error = e
+            finally:
+                if self.global_limiter is not None:
+                    self.global_limiter.release()
+
+                # the slot is given back however the request ended, so a failed request never shrinks the limit for good
+                self.limiter.release(throttled=resp is not None and resp.status_code in (429, 503))
+
+            if resp is not None:
+                self.telemetry.observe_request(url, time.perf_counter() - start, len(resp.content), resp.status_code)
+            else:
+                self.telemetry.count('connection_errors', peloton_telemetry.get_endpoint(url))
+
+            throttled = resp is not None and resp.status_code in (429, 503)
+
+            # an expired session is renewed and the request sent once more with the new cookies
+            if resp is not None and resp.status_code == 401 and retry_auth and self.reauthenticate is not None:
+                self._renew_auth(generation)
+                retry_auth = False
+                continue
+
+            retryable = error is not None or resp.status_code in self._retry_status_codes
+
+            if not retryable or attempt >= self.max_retries:
+                if error is not None:
+                    raise error
+
+                return resp
+
+            # exponential backoff with full jitter, unless the api told us how long to wait
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+            if resp is not None:
+                retry_after = self._get_retry_after(resp)
+
+                if retry_after is not None:
+                    delay = retry_after + random.uniform(0, self.backoff)
+                    self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+
+            if throttled:
+                self.throttled += 1
+
+            self.retries += 1
+            attempt += 1
+            self.telemetry.count('retries', peloton_telemetry.get_endpoint(url))
+
+            reason = error if error is not None else f'status {resp.status_code}'
+            self.logger.debug('Retrying %s %s in %.2fs after %s (attempt %s)', method, url, delay, reason, attempt)
+
+            time.sleep(delay)
+
+
+    def get_cached_content(self, url):
+
+        if self.cache is None:
+            return None
+
+        content = self.cache.get_content(url)
+
+        if content is not None:
+            self.telemetry.count('cache_hits', peloton_telemetry.get_endpoint(url))
+
+        return content
+
+
+    def get_content(self, url, use_cache=True):
+
+        # raw response bytes, read from the cache but never written to it since they are not parsed here
+        content = self.get_cached_content(url) if use_cache else None
+
+        if content is not None:
+            # a cache warmed before archiving was turned on still fills the archive
+            if self.archive is not None and self.archive.is_missing(url):
+                self.archive.append(url, content)
+
+            return content
+
+        resp = self.request('GET', url)
+
+        if resp.status_code != 200:
+            return None
+
+        # every fetched response is kept for offline replay
+        if self.archive is not None:
+            self.archive.append(url, resp.content)
+
+        return resp.content
+
+
+    def get_json(self, url, cache_if=None, use_cache=True):
+
+        cache = self.cache if use_cache else None
+
+        # serve from the cache when possible, only storing payloads that pass cache_if
+        if cache is not None:
+            payload = cache.get(url)
+            if payload is not None:
+                self.telemetry.count('cache_hits', peloton_telemetry.get_endpoint(url))
+
+                if self.archive is not None and self.archive.is_missing(url):
+                    self.archive.append(url, json.dumps(payload).encode('utf-8'))
+
+                return payload
+
+        resp = self.request('GET', url)
+
+        if resp.status_code != 200:
+            return None
+
+        payload = resp.json()
+
+        if self.archive is not None:
+            self.archive.append(url, resp.content)
+
+        if cache is not None and (cache_if is None or cache_if(payload)):
+            cache.set(url, payload)
+
+        return payload
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_default_client():
+
+    global _default_client
+
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = PelotonClient(peloton_session.get_default_session())
+
+    return _default_client
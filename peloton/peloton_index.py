@@ -0,0 +1,65 @@
+import logging
+import sqlite3
+import threading
+
+
+class IdIndex:
+
+    # constructor
+    def __init__(self, path):
+
+        self.path = path
+        self.logger = logging.getLogger('peloton')
+
+        # ids are added from the load orchestrator's threads
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+
+        # ids are kept per sink table, so another sink or dataset never skips ids it has not loaded; ids indexed
+        # before they were scoped are seeded again from the sink
+        self._conn.executescript('''
+            DROP TABLE IF EXISTS ids;
+            CREATE TABLE IF NOT EXISTS table_ids (
+                scope TEXT NOT NULL,
+                id TEXT NOT NULL,
+                PRIMARY KEY (scope, id)
+            );
+        ''')
+        self._conn.commit()
+
+
+    def get_ids(self, scope):
+
+        with self._lock:
+            rows = self._conn.execute('SELECT id FROM table_ids WHERE scope = ?', (scope,)).fetchall()
+
+        return set(row[0] for row in rows)
+
+
+    def add(self, sink, table_id, ids):
+
+        scope = sink.get_table_uri(table_id)
+
+        with self._lock:
+            self._conn.executemany('INSERT OR IGNORE INTO table_ids (scope, id) VALUES (?, ?)', [(scope, id) for id in ids if id is not None])
+            self._conn.commit()
+
+
+    def load(self, sink, table_id, key):
+
+        ids = self.get_ids(sink.get_table_uri(table_id))
+
+        # an empty index is seeded from what the sink already holds, e.g. on the first run or after losing the file
+        if len(ids) == 0:
+            ids = set(sink.get_ids(table_id, key))
+            self.add(sink, table_id, ids)
+
+            self.logger.info(f'Seeded {len(ids)} {key} values from {table_id}')
+
+        return ids
+
+
+    def close(self):
+
+        with self._lock:
+            self._conn.close()
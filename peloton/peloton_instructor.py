@@ -1,85 +1,95 @@
+import collections
 import logging
 
-import requests
+import peloton_http
+import peloton_util
 
-from google.cloud import bigquery
-import pandas as pd
+
+InstructorRecord = collections.namedtuple('InstructorRecord', [
+    'instructor_id', 'last_name', 'first_name', 'display_name', 'spotify_playlist_uri', 'image_url',
+])
 
 
 class PelotonInstructor:
 
-    _base_url = 'https://api.onepeloton.com'
+    _base_url = peloton_util.BASE_URL
     _headers = {
             'Content-Type': 'application/json',
             'User-Agent': 'peloton'
         }
 
     # constructor
-    def __init__(self, instructor_id):
+    def __init__(self, instructor_id, client=None):
 
         self.instructor_id = instructor_id
         self.logger = logging.getLogger('peloton')
-        self.session = requests.Session()
+        self.client = client or peloton_http.get_default_client()
         
         instructor_url = f'{self._base_url}/api/instructor/{self.instructor_id}'
 
-        resp = self.session.get(instructor_url)
-        
+        resp_json = self.client.get_json(instructor_url)
 
-        if resp.status_code != 200:
+        if resp_json is None:
             logging.error(f'Failed to fetch instructor id {self.instructor_id}')
             raise ValueError(f'Failed to fetch instructor id {self.instructor_id}') 
         
-        self.logger.debug(f'Successfully fetched instructor id {self.instructor_id}')
-
-        resp_json = resp.json()
+        self.logger.debug('Successfully fetched instructor id %s', self.instructor_id)
 
         self.display_name = resp_json['name']
-        self.logger.debug(f'Set display_name to {self.display_name}')
+        self.logger.debug('Set display_name to %s', self.display_name)
 
         self.first_name = resp_json['first_name']
-        self.logger.debug(f'Set first_name to {self.first_name}')
+        self.logger.debug('Set first_name to %s', self.first_name)
 
         self.last_name = resp_json['last_name']
-        self.logger.debug(f'Set last_name to {self.last_name}')
+        self.logger.debug('Set last_name to %s', self.last_name)
 
         self.spotify_playlist_uri = resp_json['spotify_playlist_uri']
-        self.logger.debug(f'Set spotify_playlist_uri to {self.spotify_playlist_uri}')
+        self.logger.debug('Set spotify_playlist_uri to %s', self.spotify_playlist_uri)
 
         self.image_url = resp_json['image_url']
-        self.logger.debug(f'Set image_url to {self.image_url}')
+        self.logger.debug('Set image_url to %s', self.image_url)
 
         self.fitness_disciplines = resp_json['fitness_disciplines']
-        self.logger.debug(f'Set fitness_disciplines to {self.fitness_disciplines}')
+        self.logger.debug('Set fitness_disciplines to %s', self.fitness_disciplines)
 
 
-    def get_bigquery_job_config(self):
-        job_config = bigquery.LoadJobConfig(
-            schema=[
-                bigquery.SchemaField('instructor_id', 'STRING'),
-                bigquery.SchemaField('last_name', 'STRING'),
-                bigquery.SchemaField('first_name', 'STRING'),
-                bigquery.SchemaField('display_name', 'STRING'),
-                bigquery.SchemaField('spotify_playlist_uri', 'STRING'),
-                bigquery.SchemaField('image_url', 'STRING'),
-            ],
-            write_disposition='WRITE_TRUNCATE'
-        )
+    def to_record(self):
 
-        return job_config
+        return InstructorRecord(*(getattr(self, field) for field in InstructorRecord._fields))
 
 
-    def to_df(self):
+    @classmethod
+    def get_bigquery_job_config(cls, write_disposition='WRITE_TRUNCATE'):
+
+        import peloton_loader
+
+        return peloton_loader.get_job_config('instructors', write_disposition)
+
+
+    @classmethod
+    def to_columns(cls, instructors):
+
         output = {
-            'instructor_id': [self.instructor_id],
-            'last_name': [self.last_name],
-            'first_name': [self.first_name],
-            'display_name': [self.display_name],
-            'spotify_playlist_uri': [self.spotify_playlist_uri],
-            'image_url': [self.image_url],
+            'instructor_id': [instructor.instructor_id for instructor in instructors],
+            'last_name': [instructor.last_name for instructor in instructors],
+            'first_name': [instructor.first_name for instructor in instructors],
+            'display_name': [instructor.display_name for instructor in instructors],
+            'spotify_playlist_uri': [instructor.spotify_playlist_uri for instructor in instructors],
+            'image_url': [instructor.image_url for instructor in instructors],
         }
 
-        df = pd.DataFrame(output)
+        return output
+
+
+    @classmethod
+    def to_frame(cls, instructors):
+
+        import pandas as pd
 
-        return df
+        return pd.DataFrame(cls.to_columns(instructors))
+
+
+    def to_df(self):
 
+        return self.to_frame([self])
@@ -0,0 +1,142 @@
+import functools
+import logging
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# one arrow schema per table, the bigquery load schemas are derived from these
+SCHEMAS = {
+    'users': pa.schema([
+        ('user_id', pa.string()),
+        ('last_name', pa.string()),
+        ('first_name', pa.string()),
+        ('display_name', pa.string()),
+        ('gender', pa.string()),
+        ('email', pa.string()),
+        ('last_workout', pa.timestamp('s', tz='UTC')),
+        ('total_workouts', pa.int64()),
+    ]),
+    'workouts': pa.schema([
+        ('workout_id', pa.string()),
+        ('user_id', pa.string()),
+        ('ride_id', pa.string()),
+        ('created_at', pa.timestamp('s', tz='UTC')),
+        ('fitness_discipline', pa.string()),
+        ('total_work_joule', pa.float64()),
+        ('total_calories', pa.float64()),
+        ('distance_miles', pa.float64()),
+        ('average_pace', pa.float64()),
+        ('average_speed', pa.float64()),
+        ('maximum_speed', pa.float64()),
+        ('best_mile', pa.float64()),
+        ('average_heart_rate', pa.float64()),
+        ('maximum_heart_rate', pa.float64()),
+        ('is_total_work_personal_record', pa.bool_()),
+        ('status', pa.string()),
+    ]),
+    'workout_metrics': pa.schema([
+        ('workout_id', pa.string()),
+        ('metric', pa.string()),
+        ('offset_seconds', pa.int64()),
+        ('value', pa.float64()),
+    ]),
+    'workout_training_metrics': pa.schema([
+        ('workout_id', pa.string()),
+        ('normalized_power', pa.float64()),
+        ('intensity_factor', pa.float64()),
+        ('training_stress_score', pa.float64()),
+        ('best_5s_power', pa.float64()),
+        ('best_1m_power', pa.float64()),
+        ('best_5m_power', pa.float64()),
+        ('best_20m_power', pa.float64()),
+        ('heart_rate_zone_1_seconds', pa.float64()),
+        ('heart_rate_zone_2_seconds', pa.float64()),
+        ('heart_rate_zone_3_seconds', pa.float64()),
+        ('heart_rate_zone_4_seconds', pa.float64()),
+        ('heart_rate_zone_5_seconds', pa.float64()),
+    ]),
+    'rides': pa.schema([
+        ('ride_id', pa.string()),
+        ('instructor_id', pa.string()),
+        ('ride_type', pa.string()),
+        ('title', pa.string()),
+        ('description', pa.string()),
+        ('duration_minutes', pa.int64()),
+        ('fitness_discipline', pa.string()),
+    ]),
+    'instructors': pa.schema([
+        ('instructor_id', pa.string()),
+        ('last_name', pa.string()),
+        ('first_name', pa.string()),
+        ('display_name', pa.string()),
+        ('spotify_playlist_uri', pa.string()),
+        ('image_url', pa.string()),
+    ]),
+}
+
+_bigquery_types = {
+    pa.string(): 'STRING',
+    pa.int64(): 'INTEGER',
+    pa.float64(): 'FLOAT',
+    pa.bool_(): 'BOOLEAN',
+    pa.timestamp('s', tz='UTC'): 'TIMESTAMP',
+}
+
+
+@functools.lru_cache(maxsize=None)
+def get_bigquery_schema(table):
+
+    from google.cloud import bigquery
+
+    return [bigquery.SchemaField(field.name, _bigquery_types[field.type]) for field in SCHEMAS[table]]
+
+
+def get_job_config(table, write_disposition='WRITE_TRUNCATE'):
+
+    # imported here so local runs do not need the google cloud libraries
+    from google.cloud import bigquery
+
+    job_config = bigquery.LoadJobConfig(
+        schema=get_bigquery_schema(table),
+        source_format=bigquery.SourceFormat.PARQUET,
+        write_disposition=write_disposition
+    )
+
+    return job_config
+
+
+def to_arrow(table, columns):
+
+    return pa.Table.from_pydict(columns, schema=SCHEMAS[table])
+
+
+def write_parquet(table, columns, where, compression='snappy', row_group_size=None):
+
+    arrow_table = to_arrow(table, columns)
+
+    # parquet has no second resolution timestamps, bigquery reads microseconds
+    pq.write_table(arrow_table, where, compression=compression, row_group_size=row_group_size, coerce_timestamps='us')
+
+    return arrow_table.num_rows
+
+
+def merge_table(client, staging_table_id, table_id, key):
+
+    logger = logging.getLogger('peloton')
+
+    # only rows whose key is not in the target table yet are inserted
+    query = f'''
+        MERGE `{table_id}` T
+        USING `{staging_table_id}` S
+        ON T.{key} = S.{key}
+        WHEN NOT MATCHED THEN
+            INSERT ROW
+    '''
+
+    job = client.query(query)
+    job.result()
+
+    logger.info(f'Merged {job.num_dml_affected_rows} new rows from {staging_table_id} into {table_id}')
+
+    return job
@@ -0,0 +1,186 @@
+import collections
+
+import numpy as np
+import pyarrow as pa
+
+import peloton_loader
+
+
+# the per sample series kept from each performance graph, a metric's code is its position here
+METRICS = ['output', 'cadence', 'resistance', 'speed', 'heart_rate']
+
+_metric_codes = {metric: code for code, metric in enumerate(METRICS)}
+
+# rolling windows in seconds whose best average power is reported
+BEST_EFFORTS = {
+    'best_5s_power': 5,
+    'best_1m_power': 60,
+    'best_5m_power': 300,
+    'best_20m_power': 1200,
+}
+
+HEART_RATE_ZONES = 5
+
+# one workout's samples as flat arrays, every metric's series laid end to end, plus what training metrics need
+WorkoutMetrics = collections.namedtuple('WorkoutMetrics', ['workout_id', 'metric_codes', 'offsets', 'values', 'interval',
+                                                           'zone_bounds', 'ftp'])
+
+
+def _get_zone_bounds(resp_json):
+
+    # the lower bound of every heart rate zone but the first, nan when the graph has no zones
+    heart_rate = next((metric for metric in resp_json.get('metrics') or [] if metric.get('slug') == 'heart_rate'), None)
+    zones = sorted((heart_rate or dict()).get('zones') or [], key=lambda zone: zone['min_value'])
+
+    if len(zones) != HEART_RATE_ZONES:
+        return np.full(HEART_RATE_ZONES - 1, np.nan)
+
+    return np.asarray([zone['min_value'] for zone in zones[1:]], dtype=np.float64)
+
+
+def extract_metrics(workout_id, resp_json, ftp=None):
+
+    offsets = np.asarray(resp_json.get('seconds_since_pedaling_start') or [], dtype=np.int64)
+
+    # samples are evenly spaced, every_n seconds apart; a zero spacing would divide the rolling windows by zero
+    interval = max(int(offsets[1] - offsets[0]), 1) if len(offsets) > 1 else 1
+    zone_bounds = _get_zone_bounds(resp_json)
+
+    codes = []
+    series = []
+
+    for metric in resp_json.get('metrics') or []:
+        code = _metric_codes.get(metric.get('slug'))
+
+        if code is None or not metric.get('values'):
+            continue
+
+        # missing samples come back as null and become nan here
+        values = np.asarray(metric['values'], dtype=np.float64)[:len(offsets)]
+
+        codes.append(code)
+        series.append(values)
+
+    if len(series) == 0:
+        return WorkoutMetrics(workout_id, np.empty(0, dtype=np.int8), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64),
+                              interval, zone_bounds, ftp)
+
+    lengths = [len(values) for values in series]
+
+    return WorkoutMetrics(
+        workout_id,
+        np.repeat(np.asarray(codes, dtype=np.int8), lengths),
+        np.concatenate([offsets[:length] for length in lengths]),
+        np.concatenate(series),
+        interval,
+        zone_bounds,
+        ftp,
+    )
+
+
+def to_columns(items):
+
+    if len(items) == 0:
+        return {'workout_id': [], 'metric': [], 'offset_seconds': [], 'value': []}
+
+    # repeated strings are gathered by arrow from one value per workout and per metric; take needs arrow indices
+    # on older pyarrow releases, so the numpy ones are wrapped
+    counts = np.fromiter((len(item.values) for item in items), dtype=np.int64, count=len(items))
+    workout_index = np.repeat(np.arange(len(items)), counts)
+    metric_codes = np.concatenate([item.metric_codes for item in items])
+    values = np.concatenate([item.values for item in items])
+
+    output = {
+        'workout_id': pa.array([item.workout_id for item in items], pa.string()).take(pa.array(workout_index)),
+        'metric': pa.array(METRICS, pa.string()).take(pa.array(metric_codes)),
+        'offset_seconds': np.concatenate([item.offsets for item in items]),
+        'value': pa.array(values, pa.float64(), from_pandas=True),
+    }
+
+    return output
+
+
+def _rolling_mean(values, group_starts, windows):
+
+    # mean of the window of samples ending at each sample, from cumulative sums; nan where the window would
+    # reach back into the previous workout
+    sums = np.concatenate([[0.0], np.cumsum(values)])
+    ends = np.arange(1, len(values) + 1)
+    begins = ends - windows
+
+    means = np.full(len(values), np.nan)
+    valid = begins >= group_starts
+    means[valid] = (sums[ends[valid]] - sums[begins[valid]]) / windows[valid]
+
+    return means
+
+
+def to_training_columns(items):
+
+    count = len(items)
+
+    if count == 0:
+        return {field.name: [] for field in peloton_loader.SCHEMAS['workout_training_metrics']}
+
+    # the whole batch is processed as one flat array, each sample tagged with its workout's position
+    workout_index = np.repeat(np.arange(count), [len(item.values) for item in items])
+    metric_codes = np.concatenate([item.metric_codes for item in items])
+    values = np.concatenate([item.values for item in items])
+
+    intervals = np.asarray([item.interval for item in items], dtype=np.int64)
+    ftp = np.asarray([item.ftp or np.nan for item in items], dtype=np.float64)
+    zone_bounds = np.stack([item.zone_bounds for item in items])
+
+    # power
+    power_mask = metric_codes == _metric_codes['output']
+    power = np.nan_to_num(values[power_mask])
+    power_index = workout_index[power_mask]
+
+    power_counts = np.bincount(power_index, minlength=count)
+    power_starts = (np.cumsum(power_counts) - power_counts)[power_index]
+    power_intervals = intervals[power_index]
+
+    # normalized power is the fourth root of the mean fourth power of the 30 second rolling average
+    rolling = _rolling_mean(power, power_starts, np.maximum(30 // power_intervals, 1))
+    valid = ~np.isnan(rolling)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normalized_power = (np.bincount(power_index[valid], weights=rolling[valid] ** 4, minlength=count)
+                            / np.bincount(power_index[valid], minlength=count)) ** 0.25
+        intensity_factor = normalized_power / ftp
+        training_stress_score = power_counts * intervals * normalized_power * intensity_factor / (ftp * 3600) * 100
+
+    output = {
+        'workout_id': [item.workout_id for item in items],
+        'normalized_power': normalized_power,
+        'intensity_factor': intensity_factor,
+        'training_stress_score': training_stress_score,
+    }
+
+    for column, seconds in BEST_EFFORTS.items():
+        rolling = _rolling_mean(power, power_starts, np.maximum(seconds // power_intervals, 1))
+        valid = ~np.isnan(rolling)
+
+        best = np.full(count, np.nan)
+        np.fmax.at(best, power_index[valid], rolling[valid])
+        output[column] = best
+
+    # heart rate zones, each sample counts for one interval in the zone its value falls into
+    heart_rate_mask = (metric_codes == _metric_codes['heart_rate']) & ~np.isnan(values)
+    heart_rate = values[heart_rate_mask]
+    heart_rate_index = workout_index[heart_rate_mask]
+
+    zones = (heart_rate[:, None] >= zone_bounds[heart_rate_index]).sum(axis=1)
+    zone_seconds = np.bincount(heart_rate_index * HEART_RATE_ZONES + zones, weights=intervals[heart_rate_index],
+                               minlength=count * HEART_RATE_ZONES).reshape(count, HEART_RATE_ZONES)
+    zone_seconds[np.isnan(zone_bounds).any(axis=1) | (np.bincount(heart_rate_index, minlength=count) == 0)] = np.nan
+
+    for zone in range(HEART_RATE_ZONES):
+        output[f'heart_rate_zone_{zone + 1}_seconds'] = zone_seconds[:, zone]
+
+    # nan marks a metric that could not be computed, e.g. without an ftp or a heart rate monitor, and is loaded as null
+    for column, metric in output.items():
+        if column != 'workout_id':
+            output[column] = pa.array(metric, pa.float64(), from_pandas=True)
+
+    return output
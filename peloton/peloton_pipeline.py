@@ -0,0 +1,192 @@
+import concurrent.futures
+import logging
+import queue
+import threading
+import time
+
+import peloton_telemetry
+
+
+class BatchLoader:
+
+    # constructor
+    def __init__(self, sink, table, table_id, to_columns, write_disposition='WRITE_TRUNCATE', batch_size=5000, max_pending_batches=2,
+                 merge_table_id=None, merge_key=None, checkpoint=None, get_keys=None):
+
+        self.sink = sink
+        self.table = table
+        self.table_id = table_id
+        self.to_columns = to_columns
+        self.write_disposition = write_disposition
+        self.batch_size = batch_size
+        self.merge_table_id = merge_table_id
+        self.merge_key = merge_key
+        self.checkpoint = checkpoint
+        self.get_keys = get_keys
+        self.logger = logging.getLogger('peloton')
+        self.rows_loaded = 0
+        self.batches_loaded = 0
+        self.error = None
+
+        # a resumed run continues numbering after the batches that already made it in
+        if self.checkpoint is not None:
+            self.batches_loaded, self.rows_loaded = self.checkpoint.get_batches(self.table_id)
+
+        self._items = list()
+        self._lock = threading.Lock()
+
+        # a bounded queue makes fetching wait when loading falls behind, so memory stays flat
+        self._queue = queue.Queue(maxsize=max_pending_batches)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+
+    def append(self, item):
+
+        # several producers (e.g. one per account) may feed the same loader
+        with self._lock:
+            self._items.append(item)
+
+            if len(self._items) >= self.batch_size:
+                self._flush()
+
+
+    def flush(self):
+
+        with self._lock:
+            self._flush()
+
+
+    def _flush(self):
+
+        if self.error is not None:
+            raise self.error
+
+        if len(self._items) > 0:
+            self._queue.put(self._items)
+            self._items = list()
+
+
+    def close(self):
+
+        # an empty run still loads one empty batch so a truncating load empties the table
+        if self.batches_loaded == 0 and self._queue.empty() and len(self._items) == 0:
+            self._queue.put(list())
+
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+
+        if self.error is not None:
+            raise self.error
+
+        self.logger.info(f'Loaded {self.rows_loaded} rows in {self.batches_loaded} batches to {self.table_id}')
+
+        # when loading into a staging table, merge only the new keys into the real one
+        if self.merge_table_id is not None and self.rows_loaded > 0:
+            self.sink.merge(self.table_id, self.merge_table_id, self.merge_key)
+
+
+    def _run(self):
+
+        while True:
+            items = self._queue.get()
+
+            if items is None:
+                break
+
+            # after a failure keep draining the queue so producers never block, close() re-raises the error
+            if self.error is not None:
+                continue
+
+            try:
+                self._load(items)
+            except Exception as e:
+                self.logger.error(f'Failed to load batch {self.batches_loaded} to {self.table_id}: {e}')
+                self.error = e
+
+
+    def _load(self, items):
+
+        # only the first batch may truncate the table, every later batch appends to it
+        write_disposition = self.write_disposition if self.batches_loaded == 0 else 'WRITE_APPEND'
+
+        keys = None if self.checkpoint is None else [self.get_keys(item) for item in items]
+        job_id = None if self.checkpoint is None else self.checkpoint.get_job_id(self.table_id, keys)
+
+        columns = self.to_columns(items)
+
+        job = self.sink.load(self.table, self.table_id, columns, write_disposition, job_id=job_id)
+        job.result()
+
+        # an item may expand into many rows, e.g. one workout's metrics
+        num_rows = len(next(iter(columns.values())))
+        peloton_telemetry.get_telemetry().add_rows(self.table, num_rows)
+
+        if self.checkpoint is not None:
+            self.checkpoint.record_batch(self.table_id, self.batches_loaded, keys, num_rows)
+
+        self.rows_loaded += num_rows
+        self.batches_loaded += 1
+
+        self.logger.debug('Loaded batch of %s rows to %s', num_rows, self.table_id)
+
+
+class LoadError(Exception):
+
+    # constructor
+    def __init__(self, errors):
+
+        self.errors = errors
+        super().__init__('Failed loads: ' + ', '.join(f'{name} ({error})' for name, error in errors.items()))
+
+
+class LoadOrchestrator:
+
+    # constructor
+    def __init__(self, max_workers=4):
+
+        self.logger = logging.getLogger('peloton')
+        self.timings = dict()
+        self.errors = dict()
+
+        self._futures = dict()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+
+    def _timed(self, name, func, *args):
+
+        start = time.perf_counter()
+
+        try:
+            with peloton_telemetry.get_telemetry().stage(f'load {name}'):
+                return func(*args)
+        finally:
+            self.timings[name] = time.perf_counter() - start
+            self.logger.info(f'Load {name} finished in {self.timings[name]:.2f}s')
+
+
+    def submit(self, name, func, *args):
+
+        # loads run in the background so the next table's fetch can start right away
+        self._futures[name] = self._executor.submit(self._timed, name, func, *args)
+
+        return self._futures[name]
+
+
+    def wait(self):
+
+        # wait on every load before reporting, so one failure never hides another
+        for name, future in self._futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                self.logger.error(f'Load {name} failed: {e}')
+                self.errors[name] = e
+
+        self._executor.shutdown()
+
+        if len(self.errors) > 0:
+            raise LoadError(self.errors)
+
+        return self.timings
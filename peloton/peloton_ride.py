@@ -1,16 +1,17 @@
+import collections
 import logging
 
-import requests
+import peloton_util
 
-from google.cloud import bigquery
-import pandas as pd
 
-import peloton_user
+RideRecord = collections.namedtuple('RideRecord', [
+    'ride_id', 'instructor_id', 'ride_type_display_name', 'title', 'description', 'duration', 'fitness_discipline',
+])
 
 
 class PelotonRide:
 
-    _base_url = 'https://api.onepeloton.com'
+    _base_url = peloton_util.BASE_URL
     _headers = {
         'Content-Type': 'application/json',
         'User-Agent': 'peloton'
@@ -25,82 +26,74 @@ class PelotonRide:
         self.logger = logging.getLogger('peloton')
         
         ride_url = f'{self._base_url}/api/ride/{self.ride_id}/details'
-        resp = peloton_user.session.get(ride_url)
+        resp_json = peloton_user.client.get_json(ride_url)
 
-        if resp.status_code != 200:
+        if resp_json is None:
             logging.error(f'Failed to fetch ride id {self.ride_id}')
             raise ValueError(f'Failed to fetch ride id {self.ride_id}') 
         
-        self.logger.debug(f'Successfully fetched ride id {self.ride_id}')
-
-        resp_json = resp.json()
+        self.logger.debug('Successfully fetched ride id %s', self.ride_id)
 
         self.instructor_id = resp_json['ride']['instructor_id']
-        self.logger.debug(f'Set instructor_id to {self.instructor_id}')
+        self.logger.debug('Set instructor_id to %s', self.instructor_id)
 
         self.ride_type_id = resp_json['ride']['ride_type_id']
-        self.logger.debug(f'Set ride_type_id to {self.ride_type_id}')
+        self.logger.debug('Set ride_type_id to %s', self.ride_type_id)
 
         self.title = resp_json['ride']['title']
-        self.logger.debug(f'Set title to {self.title}')
+        self.logger.debug('Set title to %s', self.title)
 
         self.description = resp_json['ride']['description']
-        self.logger.debug(f'Set description to {self.description}')
+        self.logger.debug('Set description to %s', self.description)
 
         # duration in seconds
         self.duration = resp_json['ride']['duration']
-        self.logger.debug(f'Set duration to {self.duration}')
+        self.logger.debug('Set duration to %s', self.duration)
 
         self.fitness_discipline = resp_json['ride']['fitness_discipline_display_name']
-        self.logger.debug(f'Set fitness_discipline to {self.fitness_discipline}')
+        self.logger.debug('Set fitness_discipline to %s', self.fitness_discipline)
 
         self.difficulty_estimate = resp_json['ride']['difficulty_estimate']
-        self.logger.debug(f'Set difficulty_estimate to {self.difficulty_estimate}')
+        self.logger.debug('Set difficulty_estimate to %s', self.difficulty_estimate)
 
 
-    def get_ride_types(self):
-        ride_types_url = f'{self._base_url}/api/ride/metadata_mappings'
-        resp = self.peloton_user.session.get(ride_types_url)
+    def to_record(self):
 
-        if resp.status_code != 200:
-            logging.error(f'Failed to fetch ride type ids {self.ride_id}')
-            raise ValueError(f'Failed to fetch ride type ids {self.ride_id}') 
-        
-        self.logger.debug(f'Successfully fetched ride type ids {self.ride_id}')
+        return RideRecord(*(getattr(self, field) for field in RideRecord._fields))
 
-        resp_json = resp.json()
-        return resp_json['class_types']
 
+    @classmethod
+    def get_bigquery_job_config(cls, write_disposition='WRITE_TRUNCATE'):
 
-    def get_bigquery_job_config(self):
-        job_config = bigquery.LoadJobConfig(
-            schema=[
-                bigquery.SchemaField('ride_id', 'STRING'),
-                bigquery.SchemaField('instructor_id', 'STRING'),
-                bigquery.SchemaField('ride_type', 'STRING'),
-                bigquery.SchemaField('title', 'STRING'),
-                bigquery.SchemaField('description', 'STRING'),
-                bigquery.SchemaField('duration_minutes', 'INTEGER'),
-                bigquery.SchemaField('fitness_discipline', 'STRING'),
-            ],
-            write_disposition='WRITE_TRUNCATE'
-        )
+        import peloton_loader
 
-        return job_config
+        return peloton_loader.get_job_config('rides', write_disposition)
 
 
-    def to_df(self):
+    @classmethod
+    def to_columns(cls, rides):
+
         output = {
-            'ride_id': [self.ride_id],
-            'instructor_id': [self.instructor_id],
-            'ride_type': [self.ride_type_display_name],
-            'title': [self.title],
-            'description': [self.description],
-            'duration_minutes': [self.duration / 60],
-            'fitness_discipline': [self.fitness_discipline],
+            'ride_id': [ride.ride_id for ride in rides],
+            'instructor_id': [ride.instructor_id for ride in rides],
+            'ride_type': [ride.ride_type_display_name for ride in rides],
+            'title': [ride.title for ride in rides],
+            'description': [ride.description for ride in rides],
+            'duration_minutes': [ride.duration // 60 for ride in rides],
+            'fitness_discipline': [ride.fitness_discipline for ride in rides],
         }
 
-        df = pd.DataFrame(output)
+        return output
+
 
-        return df
+    @classmethod
+    def to_frame(cls, rides):
+
+        import pandas as pd
+
+        return pd.DataFrame(cls.to_columns(rides))
+
+
+    def to_df(self):
 
+        return self.to_frame([self])
@@ -0,0 +1,40 @@
+import concurrent.futures
+import logging
+import threading
+
+import peloton_http
+import peloton_session
+
+
+class AccountScheduler:
+
+    # constructor
+    def __init__(self, max_accounts=4, max_workers=32, account_workers=16, rate=None):
+
+        self.max_accounts = max_accounts
+        self.account_workers = account_workers
+        self.logger = logging.getLogger('peloton')
+
+        # shared by every account's client, so the api sees at most max_workers requests and rate per second overall
+        self.global_limiter = threading.BoundedSemaphore(max_workers)
+        self.bucket = peloton_http.TokenBucket(rate) if rate else None
+
+
+    def create_client(self, cache=None, max_retries=5, archive=None):
+
+        # each account needs its own session for its login cookie, but shares the global limits
+        session = peloton_session.create_session(pool_size=self.account_workers * 2)
+
+        return peloton_http.PelotonClient(session, cache=cache, max_retries=max_retries, max_concurrency=self.account_workers,
+                                          bucket=self.bucket, global_limiter=self.global_limiter, archive=archive)
+
+
+    def map(self, func, accounts):
+
+        # run up to max_accounts account pipelines at once, results come back in account order
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_accounts) as executor:
+            results = list(executor.map(func, accounts))
+
+        self.logger.info(f'Ran {len(results)} accounts, {self.max_accounts} at a time')
+
+        return results
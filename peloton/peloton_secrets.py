@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+
+
+class EnvSecretProvider:
+
+    # constructor
+    def __init__(self, variable='PASSWORD'):
+
+        self.variable = variable
+
+
+    def get_password(self):
+
+        return os.environ[self.variable]
+
+
+class StaticSecretProvider:
+
+    # constructor
+    def __init__(self, password):
+
+        self.password = password
+
+
+    def get_password(self):
+
+        return self.password
+
+
+class SecretManagerProvider:
+
+    # constructor
+    def __init__(self, project_id, secret):
+
+        self.project_id = project_id
+        self.secret = secret
+        self.logger = logging.getLogger('peloton')
+
+
+    def get_password(self):
+
+        from google.cloud import secretmanager
+
+        # initalize secret manager and access secret
+        manager = secretmanager.SecretManagerServiceClient()
+        name = manager.secret_version_path(self.project_id, self.secret, 'latest')
+        response = manager.access_secret_version(name)
+
+        self.logger.debug('Fetched password from secret %s', self.secret)
+
+        return response.payload.data.decode('UTF-8')
+
+
+def get_secret_provider():
+
+    # a PASSWORD in the environment skips secret manager, e.g. for offline runs and benchmarks
+    if os.environ.get('PASSWORD'):
+        return EnvSecretProvider()
+
+    return SecretManagerProvider(os.environ['GCP_PROJECT_ID'], os.environ['SECRET_MANAGER'])
+
+
+def load_accounts():
+
+    # ACCOUNTS_PATH points to a json list of {"username": ..., "password": ...} or {"username": ..., "secret": ...}
+    accounts_path = os.environ.get('ACCOUNTS_PATH')
+
+    if not accounts_path:
+        return [(os.environ['USERNAME'], get_secret_provider())]
+
+    with open(accounts_path) as f:
+        accounts = json.load(f)
+
+    output = list()
+
+    for account in accounts:
+        if 'password' in account:
+            provider = StaticSecretProvider(account['password'])
+        else:
+            provider = SecretManagerProvider(os.environ['GCP_PROJECT_ID'], account['secret'])
+
+        output.append((account['username'], provider))
+
+    return output
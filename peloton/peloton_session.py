@@ -0,0 +1,106 @@
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util import make_headers
+
+
+class PooledAdapter(HTTPAdapter):
+
+    # constructor
+    def __init__(self, *args, **kwargs):
+
+        self.requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+
+        super().__init__(*args, **kwargs)
+
+
+    def init_poolmanager(self, *args, **kwargs):
+
+        super().init_poolmanager(*args, **kwargs)
+
+        adapter = self
+
+        # count every new connection the pools open, anything else is a reused keep-alive connection
+        class CountingHTTPConnectionPool(HTTPConnectionPool):
+            def _new_conn(self):
+                adapter._count_connection()
+                return super()._new_conn()
+
+        class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+            def _new_conn(self):
+                adapter._count_connection()
+                return super()._new_conn()
+
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+
+    def _count_connection(self):
+
+        with self._lock:
+            self.connections += 1
+
+
+    def send(self, request, **kwargs):
+
+        with self._lock:
+            self.requests += 1
+
+        return super().send(request, **kwargs)
+
+
+def create_session(pool_size=16, pool_connections=4):
+
+    logger = logging.getLogger('peloton')
+
+    session = requests.Session()
+
+    # one adapter per scheme, each keeping up to pool_size keep-alive connections per host
+    adapter = PooledAdapter(pool_connections=pool_connections, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    # ask for every compression urllib3 can decode (brotli and zstd when their packages are installed)
+    session.headers.update(make_headers(accept_encoding=True, keep_alive=True))
+    session.headers['User-Agent'] = 'peloton'
+
+    logger.debug('Created session with a pool of %s connections per host', pool_size)
+
+    return session
+
+
+def get_connection_stats(session):
+
+    adapters = {id(adapter): adapter for adapter in session.adapters.values() if isinstance(adapter, PooledAdapter)}
+
+    requests_sent = sum(adapter.requests for adapter in adapters.values())
+    connections = sum(adapter.connections for adapter in adapters.values())
+
+    return {
+        'requests': requests_sent,
+        'connections': connections,
+        'reuse_ratio': round(1 - connections / requests_sent, 3) if requests_sent > 0 else None,
+    }
+
+
+_default_session = None
+_default_session_lock = threading.Lock()
+
+
+def get_default_session():
+
+    global _default_session
+
+    # public endpoints without a user share one pooled session instead of a new one per object
+    with _default_session_lock:
+        if _default_session is None:
+            _default_session = create_session()
+
+    return _default_session
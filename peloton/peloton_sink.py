@@ -0,0 +1,215 @@
+import glob
+import io
+import logging
+import os
+import uuid
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import peloton_loader
+
+
+class BigQuerySink:
+
+    # constructor
+    def __init__(self, project_id, dataset, compression='snappy', row_group_size=None):
+
+        from google.cloud import bigquery
+
+        self.client = bigquery.Client()
+        self.dataset_id = f'{project_id}.{dataset}'
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.logger = logging.getLogger('peloton')
+
+
+    def get_table_id(self, table):
+
+        return f'{self.dataset_id}.{table}'
+
+
+    def get_table_uri(self, table_id):
+
+        return f'bigquery://{table_id}'
+
+
+    def load(self, table, table_id, columns, write_disposition='WRITE_TRUNCATE', job_id=None):
+
+        from google.api_core import exceptions
+
+        buffer = io.BytesIO()
+        num_rows = peloton_loader.write_parquet(table, columns, buffer, self.compression, self.row_group_size)
+        buffer.seek(0)
+
+        try:
+            job = self.client.load_table_from_file(buffer, table_id, job_id=job_id,
+                                                   job_config=peloton_loader.get_job_config(table, write_disposition))
+        except exceptions.Conflict:
+            # this batch was submitted before a crash, wait on the original job instead of loading it twice
+            self.logger.info(f'Load job {job_id} already exists, reusing it')
+            return self.client.get_job(job_id)
+
+        self.logger.debug('Submitted load of %s rows (%s bytes) to %s', num_rows, buffer.getbuffer().nbytes, table_id)
+
+        return job
+
+
+    def merge(self, staging_table_id, table_id, key):
+
+        return peloton_loader.merge_table(self.client, staging_table_id, table_id, key)
+
+
+    def get_ids(self, table_id, key):
+
+        from google.api_core import exceptions
+
+        try:
+            rows = self.client.query(f'SELECT DISTINCT {key} FROM `{table_id}`').result()
+        except exceptions.NotFound:
+            return list()
+
+        return [row[0] for row in rows]
+
+
+    def get_high_water_marks(self, table_id):
+
+        from google.api_core import exceptions
+
+        # the newest complete workout of every user already in the table
+        query = f'''
+            SELECT user_id, UNIX_SECONDS(MAX(created_at)), ARRAY_AGG(workout_id ORDER BY created_at DESC LIMIT 1)[OFFSET(0)]
+            FROM `{table_id}`
+            WHERE status = 'COMPLETE'
+            GROUP BY user_id
+        '''
+
+        try:
+            rows = self.client.query(query).result()
+        except exceptions.NotFound:
+            return dict()
+
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+
+class LocalJob:
+
+    # loads into a local sink finish before load() returns
+    def __init__(self, num_rows):
+
+        self.num_rows = num_rows
+
+
+    def result(self):
+
+        return self
+
+
+class LocalSink:
+
+    # constructor
+    def __init__(self, path, compression='snappy', row_group_size=None):
+
+        self.path = path
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.logger = logging.getLogger('peloton')
+
+        os.makedirs(self.path, exist_ok=True)
+
+
+    def get_table_id(self, table):
+
+        return table
+
+
+    def get_table_uri(self, table_id):
+
+        return f'file://{os.path.abspath(os.path.join(self.path, table_id))}'
+
+
+    def _get_files(self, table_id):
+
+        return sorted(glob.glob(os.path.join(self.path, table_id, '*.parquet')))
+
+
+    def load(self, table, table_id, columns, write_disposition='WRITE_TRUNCATE', job_id=None):
+
+        # each table is a directory of parquet files with the same schema as its bigquery table
+        table_path = os.path.join(self.path, table_id)
+        os.makedirs(table_path, exist_ok=True)
+
+        if write_disposition == 'WRITE_TRUNCATE':
+            for file_path in self._get_files(table_id):
+                os.remove(file_path)
+
+        # a job id names the file, so reloading the same batch overwrites it instead of duplicating it
+        file_path = os.path.join(table_path, f'{job_id or uuid.uuid4().hex}.parquet')
+        num_rows = peloton_loader.write_parquet(table, columns, file_path, self.compression, self.row_group_size)
+
+        self.logger.debug('Wrote %s rows to %s', num_rows, file_path)
+
+        return LocalJob(num_rows)
+
+
+    def read(self, table_id):
+
+        files = self._get_files(table_id)
+
+        if len(files) == 0:
+            return None
+
+        return pa.concat_tables([pq.read_table(file_path) for file_path in files])
+
+
+    def get_ids(self, table_id, key):
+
+        files = self._get_files(table_id)
+
+        if len(files) == 0:
+            return list()
+
+        return pa.concat_tables([pq.read_table(file_path, columns=[key]) for file_path in files]).column(key).to_pylist()
+
+
+    def get_high_water_marks(self, table_id):
+
+        files = self._get_files(table_id)
+
+        if len(files) == 0:
+            return dict()
+
+        columns = ['user_id', 'workout_id', 'created_at', 'status']
+        rows = pa.concat_tables([pq.read_table(file_path, columns=columns) for file_path in files]).to_pydict()
+
+        # the newest complete workout of every user already in the table
+        marks = dict()
+
+        for user_id, workout_id, created_at, status in zip(*(rows[column] for column in columns)):
+            epoch = int(created_at.timestamp())
+
+            if status == 'COMPLETE' and epoch > marks.get(user_id, (0, None))[0]:
+                marks[user_id] = (epoch, workout_id)
+
+        return marks
+
+
+    def merge(self, staging_table_id, table_id, key):
+
+        staging = self.read(staging_table_id)
+        target = self.read(table_id)
+
+        if staging is None:
+            return LocalJob(0)
+
+        # append only the staged rows whose key is not in the target table yet
+        existing_keys = set() if target is None else set(target.column(key).to_pylist())
+        new_rows = staging.filter(pa.array([value not in existing_keys for value in staging.column(key).to_pylist()]))
+
+        file_path = os.path.join(self.path, table_id, f'{uuid.uuid4().hex}.parquet')
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        pq.write_table(new_rows, file_path, compression=self.compression)
+
+        self.logger.info(f'Merged {new_rows.num_rows} new rows from {staging_table_id} into {table_id}')
+
+        return LocalJob(new_rows.num_rows)
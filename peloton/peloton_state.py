@@ -0,0 +1,56 @@
+import json
+import logging
+import os
+
+import peloton_util
+
+
+class SyncState:
+
+    # constructor
+    def __init__(self, path):
+
+        self.path = path
+        self.logger = logging.getLogger('peloton')
+        self.state = dict()
+
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.state = json.load(f)
+
+            self.logger.debug('Loaded sync state from %s', self.path)
+
+
+    def get_high_water_mark(self, user_id):
+
+        user_state = self.state.get(user_id, dict())
+
+        return user_state.get('last_workout_epoch')
+
+
+    def seed(self, user_ids, sink, table_id):
+
+        missing = [user_id for user_id in user_ids if self.get_high_water_mark(user_id) is None]
+
+        if len(missing) == 0:
+            return
+
+        # marks lost with the state file, e.g. after a docker run --rm, are seeded from what the sink already holds,
+        # so an incremental run never appends a user's whole history again
+        marks = sink.get_high_water_marks(table_id)
+
+        for user_id in missing:
+            if user_id in marks:
+                self.set_high_water_mark(user_id, *marks[user_id])
+
+
+    def set_high_water_mark(self, user_id, last_workout_epoch, last_workout_id):
+
+        self.state[user_id] = {
+            'last_workout_epoch': last_workout_epoch,
+            'last_workout_id': last_workout_id
+        }
+
+        peloton_util.write_atomic(self.path, json.dumps(self.state))
+
+        self.logger.info(f'Set high-water mark for {user_id} to workout {last_workout_id} ({last_workout_epoch})')
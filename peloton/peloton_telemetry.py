@@ -0,0 +1,177 @@
+import contextlib
+import json
+import re
+import threading
+import time
+import urllib.parse
+
+import peloton_util
+
+
+# upper bounds in seconds of the request latency histogram buckets, the last bucket is unbounded
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# ids in urls are collapsed so every request to one endpoint shares a histogram
+_id_pattern = re.compile(r'/[0-9a-f]{32}(?=/|$)')
+
+
+def get_endpoint(url):
+
+    return _id_pattern.sub('/{id}', urllib.parse.urlsplit(url).path)
+
+
+class Histogram:
+
+    # constructor
+    def __init__(self, buckets=LATENCY_BUCKETS):
+
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+
+    def observe(self, value):
+
+        index = next((index for index, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+    def to_dict(self):
+
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'buckets': {str(bound): count for bound, count in zip(self.buckets + ('+Inf',), self.counts)},
+        }
+
+
+class Telemetry:
+
+    # constructor
+    def __init__(self):
+
+        self.latencies = dict()
+        self.counters = dict()
+        self.rows = dict()
+        self.stages = dict()
+        self._started_at = time.time()
+        self._lock = threading.Lock()
+
+
+    def observe_request(self, url, seconds, num_bytes, status_code):
+
+        endpoint = get_endpoint(url)
+
+        with self._lock:
+            self.latencies.setdefault(endpoint, Histogram()).observe(seconds)
+
+        self.count('requests', endpoint)
+        self.count('bytes', endpoint, num_bytes)
+        self.count(f'status_{status_code}', endpoint)
+
+
+    def count(self, name, endpoint, value=1):
+
+        with self._lock:
+            counters = self.counters.setdefault(endpoint, dict())
+            counters[name] = counters.get(name, 0) + value
+
+
+    def add_rows(self, table, rows):
+
+        with self._lock:
+            self.rows[table] = self.rows.get(table, 0) + rows
+
+
+    @contextlib.contextmanager
+    def stage(self, name):
+
+        # a stage may run on many threads at once; its wall time spans the first start to the last end,
+        # busy time adds up every run
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+
+            with self._lock:
+                stage = self.stages.setdefault(name, {'first': start, 'last': end, 'busy': 0.0, 'count': 0})
+                stage['first'] = min(stage['first'], start)
+                stage['last'] = max(stage['last'], end)
+                stage['busy'] += end - start
+                stage['count'] += 1
+
+
+    def get_report(self):
+
+        with self._lock:
+            return {
+                'started_at': self._started_at,
+                'seconds': round(time.time() - self._started_at, 3),
+                'stages': {name: {'seconds': round(stage['last'] - stage['first'], 3), 'busy_seconds': round(stage['busy'], 3),
+                                  'count': stage['count']}
+                           for name, stage in self.stages.items()},
+                'endpoints': {endpoint: dict(self.counters.get(endpoint, dict()), latency=histogram.to_dict())
+                              for endpoint, histogram in self.latencies.items()},
+                'counters': {endpoint: dict(counters) for endpoint, counters in self.counters.items()
+                             if endpoint not in self.latencies},
+                'rows': dict(self.rows),
+            }
+
+
+    def write_report(self, path):
+
+        with open(path, 'w') as f:
+            json.dump(self.get_report(), f, indent=2)
+
+
+    def to_prometheus(self):
+
+        lines = []
+
+        with self._lock:
+            lines.append('# TYPE peloton_request_duration_seconds histogram')
+            for endpoint, histogram in self.latencies.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append(f'peloton_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+                lines.append(f'peloton_request_duration_seconds_sum{{endpoint="{endpoint}"}} {histogram.sum}')
+                lines.append(f'peloton_request_duration_seconds_count{{endpoint="{endpoint}"}} {histogram.count}')
+
+            # every counter becomes its own metric, labelled by endpoint
+            names = sorted({name for counters in self.counters.values() for name in counters})
+            for name in names:
+                lines.append(f'# TYPE peloton_{name}_total counter')
+                for endpoint, counters in self.counters.items():
+                    if name in counters:
+                        lines.append(f'peloton_{name}_total{{endpoint="{endpoint}"}} {counters[name]}')
+
+            lines.append('# TYPE peloton_rows_loaded_total counter')
+            for table, rows in self.rows.items():
+                lines.append(f'peloton_rows_loaded_total{{table="{table}"}} {rows}')
+
+            lines.append('# TYPE peloton_stage_seconds gauge')
+            for name, stage in self.stages.items():
+                lines.append(f'peloton_stage_seconds{{stage="{name}"}} {stage["last"] - stage["first"]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+    def write_prometheus(self, path):
+
+        # written atomically, so a node exporter textfile collector never reads half a file
+        peloton_util.write_atomic(path, self.to_prometheus())
+
+
+_default_telemetry = Telemetry()
+
+
+def get_telemetry():
+
+    return _default_telemetry
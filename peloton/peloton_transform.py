@@ -0,0 +1,63 @@
+import concurrent.futures
+import json
+import logging
+import multiprocessing
+import os
+
+# orjson decodes large payloads several times faster, the standard library is the fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import peloton_workout
+
+
+def loads(content):
+
+    if orjson is not None:
+        return orjson.loads(content)
+
+    return json.loads(content)
+
+
+def transform_workout(workout_id, contents):
+
+    # runs in a worker process, only the compact record and the metric arrays are sent back
+    workout = peloton_workout.PelotonWorkout(None, workout_id)
+    workout.set_workout(loads(contents['workout']))
+    workout.set_workout_summary(loads(contents['summary']))
+    workout.set_workout_details(loads(contents['performance_graph']))
+
+    return workout.to_record(), workout.metrics
+
+
+def _ready():
+
+    return True
+
+
+class TransformPool:
+
+    # constructor
+    def __init__(self, max_workers=None):
+
+        self.max_workers = max_workers or os.cpu_count()
+        self.logger = logging.getLogger('peloton')
+
+        # workers are forked so they start without re-importing the pipeline; they are started right away,
+        # before the pipeline starts any threads
+        self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('fork'))
+        self._executor.submit(_ready).result()
+
+        self.logger.info(f'Started {self.max_workers} transform processes, decoding with {"orjson" if orjson else "json"}')
+
+
+    def submit(self, workout_id, contents):
+
+        return self._executor.submit(transform_workout, workout_id, contents)
+
+
+    def close(self):
+
+        self._executor.shutdown()
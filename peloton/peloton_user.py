@@ -1,25 +1,29 @@
+import collections
+import concurrent.futures
+import json
 import logging
 import math
 
-import requests
-
-from google.cloud import bigquery
-import pandas as pd
+import peloton_http
+import peloton_telemetry
+import peloton_util
 
 
 class PelotonUser:
 
-    _base_url = 'https://api.onepeloton.com'
+    _base_url = peloton_util.BASE_URL
     _headers = {
             'Content-Type': 'application/json',
             'User-Agent': 'peloton'
         }
 
     # constructor
-    def __init__(self, username, password):
+    def __init__(self, username, password=None, client=None, get_password=None, session_store=None):
         
         self.username = username
         self.password = password
+        self.get_password = get_password
+        self.session_store = session_store
         self.logger = logging.getLogger('peloton')
         self.cycling_ftp = None
         self.email = None
@@ -27,20 +31,69 @@ class PelotonUser:
         self.name = None
         self.userid = None
         self.workout_ids = None
+        self.latest_workout_epoch = None
+        self.latest_workout_id = None
+
+        # every request for this user goes through one client so rate limits and retries are shared
+        self.client = client or peloton_http.PelotonClient()
+        self.session = self.client.session
+
+        # a stored session that is still valid is reused, so the password is only fetched when logging in
+        if not self.__restore_session():
+            self.__login()
+
+        self.client.reauthenticate = self.__login
+
+
+    def __restore_session(self):
+
+        if self.session_store is None:
+            return False
+
+        stored = self.session_store.load(self.username)
+
+        if stored is None:
+            return False
+
+        import peloton_auth
+
+        peloton_auth.restore_cookies(self.session, stored)
+
+        # the profile is fetched again so counts such as total_workouts are current
+        with peloton_telemetry.get_telemetry().stage('login'):
+            resp = self.client.request('GET', f'{self._base_url}/api/me', headers=self._headers, retry_auth=False)
 
-        self.session = requests.Session()
-        self.__login()
+        if resp.status_code != 200:
+            self.logger.info(f'Stored session for {self.username} was rejected, logging in again')
+            self.session_store.delete(self.username)
+            self.session.cookies.clear()
+            return False
+
+        self.logger.info(f'Reusing stored session for {self.username}')
+
+        self.userid = stored['user_id']
+        self.logger.debug('Set userid to %s', self.userid)
+
+        self.__set_profile(resp.json())
+
+        return True
 
 
     def __login(self):
         
         auth_login_url = f'{self._base_url}/auth/login'
+
+        # the password is fetched on the first login only, later logins after a 401 reuse it
+        if self.password is None and self.get_password is not None:
+            self.password = self.get_password()
+
         auth_payload = {
             'username_or_email': self.username,
             'password': self.password
         }
 
-        resp = self.session.post(auth_login_url, json=auth_payload, headers=self._headers)
+        with peloton_telemetry.get_telemetry().stage('login'):
+            resp = self.client.request('POST', auth_login_url, json=auth_payload, headers=self._headers, retry_auth=False)
 
         if resp.status_code != 200:
             logging.error(f'Failed to login using {self.username}')
@@ -51,90 +104,143 @@ class PelotonUser:
         resp_json = resp.json()
         
         self.userid = resp_json['user_id']
-        self.logger.debug(f'Set userid to {self.userid}')
+        self.logger.debug('Set userid to %s', self.userid)
 
         if 'user_data' in resp_json:
-            self.cycling_ftp = resp_json['user_data']['cycling_ftp']
-            self.logger.debug(f'Set cycling_ftp to {self.cycling_ftp}')
+            self.__set_profile(resp_json['user_data'])
+
+        if self.session_store is not None:
+            self.session_store.save(self.username, self.session, self.userid)
+
+
+    def __set_profile(self, user_data):
+
+        self.cycling_ftp = user_data['cycling_ftp']
+        self.logger.debug('Set cycling_ftp to %s', self.cycling_ftp)
+
+        self.email = user_data['email']
+        self.logger.debug('Set email to %s', self.email)
 
-            self.email = resp_json['user_data']['email']
-            self.logger.debug(f'Set email to {self.email}')
+        self.last_workout_epoch = user_data['last_workout_at']
+        self.logger.debug('Set last_workout_epoch to %s', self.last_workout_epoch)
 
-            self.last_workout_epoch = resp_json['user_data']['last_workout_at']
-            self.logger.debug(f'Set last_workout_epoch to {self.last_workout_epoch}')
+        self.name = user_data['name']
+        self.logger.debug('Set name to %s', self.name)
 
-            self.name = resp_json['user_data']['name']
-            self.logger.debug(f'Set name to {self.name}')
+        self.last_name = user_data['last_name']
+        self.logger.debug('Set last_name to %s', self.last_name)
 
-            self.last_name = resp_json['user_data']['last_name']
-            self.logger.debug(f'Set last_name to {self.last_name}')
+        self.first_name = user_data['first_name']
+        self.logger.debug('Set first_name to %s', self.first_name)
 
-            self.first_name = resp_json['user_data']['first_name']
-            self.logger.debug(f'Set first_name to {self.first_name}')
+        self.gender = user_data['gender']
+        self.logger.debug('Set gender to %s', self.gender)
 
-            self.gender = resp_json['user_data']['gender']
-            self.logger.debug(f'Set gender to {self.gender}')
+        self.total_workouts = user_data['total_workouts']
+        self.logger.debug('Set total_workouts to %s', self.total_workouts)
 
-            self.total_workouts = resp_json['user_data']['total_workouts']
-            self.logger.debug(f'Set total_workouts to {self.total_workouts}')
+        # the profile is archived with the workouts, so a replay computes training metrics with the same ftp
+        if self.client.archive is not None:
+            self.client.archive.put('user', self.userid, 'profile', json.dumps(user_data).encode('utf-8'))
 
 
-    def get_workout_ids(self):
+    def _get_workout_page(self, page):
 
-        base_workout_url = f'{self._base_url}/api/user/{self.userid}/workouts?sort_by=-created'
+        workout_url = f'{self._base_url}/api/user/{self.userid}/workouts?sort_by=-created&page={page}&limit=100'
+        with peloton_telemetry.get_telemetry().stage('id paging'):
+            resp_json = self.client.get_json(workout_url)
+
+        if resp_json is None:
+            raise Exception('Failed to fetch workout data') 
+
+        # keep only what paging needs instead of every full workout dict
+        return [(workout['id'], workout['created_at'], workout.get('status')) for workout in resp_json['data']]
+
+
+    def iter_workout_ids(self, since_epoch=None, max_workers=8):
 
-        workout_list = list()
-        page = 0
         total_pages = math.ceil(self.total_workouts / 100)
+        pending = collections.deque()
+        next_page = 0
 
-        while page < total_pages:
-            workout_url = f'{base_workout_url}&page={page}&limit=100'
-            resp = self.session.get(workout_url)
+        # incremental runs usually need a single page, so they start with one and fan out only while
+        # whole pages are newer than the high-water mark
+        in_flight = max_workers if since_epoch is None else 1
 
-            if resp.status_code != 200:
-                raise Exception('Failed to fetch workout data') 
-        
-            resp_json = resp.json()
-            workout_list.extend(resp_json['data'])
+        self.latest_workout_epoch = None
+        self.latest_workout_id = None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            try:
+                while next_page < total_pages or pending:
+                    # keep up to in_flight pages in flight, yielding them back in page order
+                    while next_page < total_pages and len(pending) < in_flight:
+                        pending.append(executor.submit(self._get_workout_page, next_page))
+                        next_page += 1
+
+                    page_workouts = pending.popleft().result()
+
+                    if since_epoch is not None and len(page_workouts) > 0 and page_workouts[-1][1] > since_epoch:
+                        in_flight = min(max_workers, in_flight * 2)
+
+                    # workouts are sorted newest first, so stop paging at the first one we already have
+                    for workout_id, created_at, status in page_workouts:
+                        if since_epoch is not None and created_at <= since_epoch:
+                            return
+
+                        # workouts still in progress at the top are left for a later run, so the high-water mark
+                        # never moves past one that is only partly recorded
+                        if self.latest_workout_epoch is None:
+                            if status != 'COMPLETE':
+                                self.logger.debug('Skipping workout %s with status %s', workout_id, status)
+                                continue
+
+                            self.latest_workout_id, self.latest_workout_epoch = workout_id, created_at
+
+                        yield workout_id
+            finally:
+                for future in pending:
+                    future.cancel()
 
-            page += 1
 
-        # creates list of only the workout ids
-        self.workout_ids = [x['id'] for x in workout_list]
+    def get_workout_ids(self, since_epoch=None, max_workers=8):
+
+        self.workout_ids = list(self.iter_workout_ids(since_epoch=since_epoch, max_workers=max_workers))
 
         self.logger.info(f'Returning {len(self.workout_ids)} workout ids')
 
         return self.workout_ids
 
-    def get_bigquery_job_config(self):
-        job_config = bigquery.LoadJobConfig(
-            schema=[
-                bigquery.SchemaField('user_id', 'STRING'),
-                bigquery.SchemaField('last_name', 'STRING'),
-                bigquery.SchemaField('first_name', 'STRING'),
-                bigquery.SchemaField('display_name', 'STRING'),
-                bigquery.SchemaField('gender', 'STRING'),
-                bigquery.SchemaField('email', 'STRING'),
-                bigquery.SchemaField('last_workout', 'TIMESTAMP'),
-                bigquery.SchemaField('total_workouts', 'INTEGER'),
-            ],
-            write_disposition='WRITE_TRUNCATE'
-        )
-
-        return job_config
+    @classmethod
+    def get_bigquery_job_config(cls, write_disposition='WRITE_TRUNCATE'):
+
+        import peloton_loader
+
+        return peloton_loader.get_job_config('users', write_disposition)
+
+
+    @classmethod
+    def to_columns(cls, users):
 
-    def to_df(self):
         output = {
-            'user_id': [self.userid],
-            'last_name': [self.last_name],
-            'first_name': [self.first_name],
-            'display_name': [self.name],
-            'gender': [self.gender],
-            'email': [self.email],
-            'last_workout': [pd.to_datetime(self.last_workout_epoch, unit='s')],
-            'total_workouts': [self.total_workouts]
+            'user_id': [user.userid for user in users],
+            'last_name': [user.last_name for user in users],
+            'first_name': [user.first_name for user in users],
+            'display_name': [user.name for user in users],
+            'gender': [user.gender for user in users],
+            'email': [user.email for user in users],
+            'last_workout': [user.last_workout_epoch for user in users],
+            'total_workouts': [user.total_workouts for user in users],
         }
 
-        df = pd.DataFrame(output)
+        return output
+
+
+    def to_df(self):
+
+        import pandas as pd
+
+        df = pd.DataFrame(self.to_columns([self]))
+        df['last_workout'] = pd.to_datetime(df['last_workout'], unit='s')
 
         return df
@@ -0,0 +1,20 @@
+import os
+
+
+# every api url starts here; PELOTON_BASE_URL points the pipeline at another server, e.g. the mock api
+BASE_URL = os.environ.get('PELOTON_BASE_URL') or 'https://api.onepeloton.com'
+
+
+def write_atomic(path, content, mode=0o666):
+
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+
+    # written next to the target and renamed, so a crash or a concurrent reader never sees half a file
+    tmp_path = f'{path}.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+
+    os.replace(tmp_path, path)
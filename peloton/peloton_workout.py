@@ -1,136 +1,230 @@
+import collections
+import concurrent.futures
 import logging
 
-import requests
+import peloton_util
 
-from google.cloud import bigquery
-import pandas as pd
 
-import peloton_user
+# the fields to_columns reads, kept once a workout is parsed so its payloads and client can be released
+WorkoutRecord = collections.namedtuple('WorkoutRecord', [
+    'workout_id', 'user_id', 'ride_id', 'created_at_epoch', 'fitness_discipline', 'total_work_joule', 'calories',
+    'distance_miles', 'avg_pace', 'avg_speed', 'max_speed', 'best_mile', 'avg_heart_rate', 'max_heart_rate',
+    'is_total_work_personal_record', 'status',
+])
 
 
 class PelotonWorkout:
 
-    _base_url = 'https://api.onepeloton.com'
+    _base_url = peloton_util.BASE_URL
     _headers = {
             'Content-Type': 'application/json',
             'User-Agent': 'peloton'
         }
 
+    # fields filled in by each endpoint, fetched the first time one of them is read
+    _parts = {
+        'workout': ['created_at_epoch', 'is_total_work_personal_record', 'device_type', 'difficulty_estimate', 'duration',
+                    'fitness_discipline', 'instructor_id', 'user_id', 'status', 'ride_id', 'ride_title'],
+        'summary': ['calories', 'avg_heart_rate', 'max_heart_rate', 'avg_resistance', 'max_resistance', 'avg_speed',
+                    'max_speed', 'total_work_joule', 'distance_miles'],
+        'performance_graph': ['performance_graph', 'metrics', 'avg_pace', 'avg_pace_dict', 'best_mile', 'splits_dict'],
+    }
+    _field_parts = {field: part for part, fields in _parts.items() for field in fields}
+
+    _part_paths = {
+        'workout': '/api/workout/{}',
+        'summary': '/api/workout/{}/summary',
+        'performance_graph': '/api/workout/{}/performance_graph',
+    }
+
     # constructor
     def __init__(self, peloton_user, workout_id):
 
         self.peloton_user = peloton_user
         self.workout_id = workout_id
         self.logger = logging.getLogger('peloton')
-        
-        workout_url = f'{self._base_url}/api/workout/{self.workout_id}'
-        resp = peloton_user.session.get(workout_url)
+        self.hydrated = set()
+
+
+    def __getattr__(self, name):
+
+        # only called for attributes that are not set yet, so a field's endpoint is fetched on first access
+        part = self._field_parts.get(name)
+
+        if part is None or part in self.__dict__.get('hydrated', ()):
+            raise AttributeError(f'{type(self).__name__} has no attribute {name}')
+
+        self.hydrate_part(part)
+
+        return self.__dict__[name]
+
+
+    def hydrate_part(self, part):
+
+        if part == 'workout':
+            self.get_workout()
+        elif part == 'summary':
+            self.get_workout_summary()
+        elif part == 'performance_graph':
+            self.get_workout_details()
+        else:
+            raise ValueError(f'Unknown workout part {part}')
+
+
+    @classmethod
+    def hydrate(cls, workouts, parts=('workout', 'summary', 'performance_graph'), max_workers=16):
 
-        if resp.status_code != 200:
+        # fetch only the requested endpoints that are still missing, for the whole batch at once
+        tasks = [(workout, part) for workout in workouts for part in parts if part not in workout.hydrated]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(lambda task: task[0].hydrate_part(task[1]), tasks))
+
+        return workouts
+
+
+    @classmethod
+    def get_part_url(cls, workout_id, part):
+
+        return cls._base_url + cls._part_paths[part].format(workout_id)
+
+
+    def _cache_if_complete(self, payload):
+
+        # only finished workouts are immutable, so nothing is cached until the workout is known to be complete
+        return self.__dict__.get('status') == 'COMPLETE'
+
+
+    def get_workout(self):
+
+        workout_url = self.get_part_url(self.workout_id, 'workout')
+        resp_json = self.peloton_user.client.get_json(workout_url, cache_if=lambda payload: payload['status'] == 'COMPLETE')
+
+        if resp_json is None:
             logging.error(f'Failed to fetch workout id {self.workout_id}')
             raise ValueError(f'Failed to fetch workout id {self.workout_id}') 
         
-        self.logger.debug(f'Successfully fetched workout id {self.workout_id}')
+        self.logger.debug('Successfully fetched workout id %s', self.workout_id)
+
+        self.set_workout(resp_json)
 
-        resp_json = resp.json()
+
+    def set_workout(self, resp_json):
 
         self.created_at_epoch = resp_json['created_at']
-        self.logger.debug(f'Set created_at to {self.created_at_epoch}')
+        self.logger.debug('Set created_at to %s', self.created_at_epoch)
 
         self.is_total_work_personal_record = resp_json['is_total_work_personal_record']
-        self.logger.debug(f'Set is_total_work_personal_record to {self.is_total_work_personal_record}')
+        self.logger.debug('Set is_total_work_personal_record to %s', self.is_total_work_personal_record)
 
         self.device_type = resp_json['device_type']
-        self.logger.debug(f'Set device_type to {self.device_type}')
+        self.logger.debug('Set device_type to %s', self.device_type)
 
         self.difficulty_estimate = resp_json['ride']['difficulty_estimate']
-        self.logger.debug(f'Set ride\'s difficulty_estimate to {self.difficulty_estimate}')
+        self.logger.debug("Set ride's difficulty_estimate to %s", self.difficulty_estimate)
 
         self.duration = resp_json['ride']['duration']
-        self.logger.debug(f'Set ride\'s duration to {self.duration}')
+        self.logger.debug("Set ride's duration to %s", self.duration)
 
         self.fitness_discipline = resp_json['fitness_discipline']
-        self.logger.debug(f'Set ride\'s fitness_discipline to {self.fitness_discipline}')
+        self.logger.debug("Set ride's fitness_discipline to %s", self.fitness_discipline)
 
         self.instructor_id = resp_json['ride']['instructor_id']
-        self.logger.debug(f'Set ride\'s instructor_id to {self.instructor_id}')
+        self.logger.debug("Set ride's instructor_id to %s", self.instructor_id)
 
         self.user_id = resp_json['user_id']
-        self.logger.debug(f'Set user_id to {self.user_id}')
+        self.logger.debug('Set user_id to %s', self.user_id)
 
         self.status = resp_json['status']
-        self.logger.debug(f'Set status to {self.status}')
+        self.logger.debug('Set status to %s', self.status)
 
         self.ride_id = resp_json['ride']['id']
-        self.logger.debug(f'Set ride id to {self.ride_id}')
+        self.logger.debug('Set ride id to %s', self.ride_id)
 
         self.ride_title = resp_json['ride']['title']
-        self.logger.debug(f'Set ride title to {self.ride_title}')
+        self.logger.debug('Set ride title to %s', self.ride_title)
+
+        self.hydrated.add('workout')
 
 
     def get_workout_summary(self):
 
-        workout_url = f'{self._base_url}/api/workout/{self.workout_id}/summary'
+        workout_url = self.get_part_url(self.workout_id, 'summary')
 
-        resp = self.peloton_user.session.get(workout_url)
+        # summaries and performance graphs of unfinished workouts still change
+        resp_json = self.peloton_user.client.get_json(workout_url, cache_if=self._cache_if_complete)
 
-        if resp.status_code != 200:
+        if resp_json is None:
             raise ValueError(f'Failed to get summary workout data for id {self.workout_id}') 
         
-        self.logger.debug(f'Successfully fetched summary workout data for id {self.workout_id}')
+        self.logger.debug('Successfully fetched summary workout data for id %s', self.workout_id)
+
+        self.set_workout_summary(resp_json)
+
 
-        resp_json = resp.json()
+    def set_workout_summary(self, resp_json):
 
         # calories
         self.calories = resp_json['calories']
-        self.logger.debug(f'Set summary.calories to {self.calories}')
+        self.logger.debug('Set summary.calories to %s', self.calories)
 
         # heart rate
         self.avg_heart_rate = resp_json['avg_heart_rate']
-        self.logger.debug(f'Set summary.avg_heart_rate to {self.avg_heart_rate}')
+        self.logger.debug('Set summary.avg_heart_rate to %s', self.avg_heart_rate)
 
         self.max_heart_rate = resp_json['max_heart_rate']
-        self.logger.debug(f'Set summary.max_heart_rate to {self.max_heart_rate}')
+        self.logger.debug('Set summary.max_heart_rate to %s', self.max_heart_rate)
 
         # resistance
         self.avg_resistance = resp_json['avg_resistance']
-        self.logger.debug(f'Set summary.avg_resistance to {self.avg_resistance}')
+        self.logger.debug('Set summary.avg_resistance to %s', self.avg_resistance)
 
         self.max_resistance = resp_json['max_resistance']
-        self.logger.debug(f'Set summary.max_resistance to {self.max_resistance}')
+        self.logger.debug('Set summary.max_resistance to %s', self.max_resistance)
 
         # speed
         self.avg_speed = resp_json['avg_speed']
-        self.logger.debug(f'Set summary.avg_speed to {self.avg_speed}')
+        self.logger.debug('Set summary.avg_speed to %s', self.avg_speed)
 
         self.max_speed = resp_json['max_speed']
-        self.logger.debug(f'Set summary.max_speed to {self.max_speed}')
+        self.logger.debug('Set summary.max_speed to %s', self.max_speed)
 
         # total work
         self.total_work_joule = resp_json['total_work']
-        self.logger.debug(f'Set total work to {self.total_work_joule}')
+        self.logger.debug('Set total work to %s', self.total_work_joule)
 
         # distance miles
         self.distance_miles = resp_json['distance']
-        self.logger.debug(f'Set distance to {self.distance_miles}')
+        self.logger.debug('Set distance to %s', self.distance_miles)
+
+        self.hydrated.add('summary')
 
 
     def get_workout_details(self):
 
-        workout_details_url = f'{self._base_url}/api/workout/{self.workout_id}/performance_graph'
+        workout_details_url = self.get_part_url(self.workout_id, 'performance_graph')
 
-        resp = self.peloton_user.session.get(workout_details_url)
+        resp_json = self.peloton_user.client.get_json(workout_details_url, cache_if=self._cache_if_complete)
 
-        if resp.status_code != 200:
+        if resp_json is None:
             raise ValueError(f'Failed to get details for workout id {self.workout_id}') 
         
-        self.logger.debug(f'Successfully fetched details for workout id {self.workout_id}')
+        self.logger.debug('Successfully fetched details for workout id %s', self.workout_id)
+
+        self.set_workout_details(resp_json)
+
 
-        resp_json = resp.json()
+    def set_workout_details(self, resp_json):
 
         # performance graph
         self.performance_graph = next((metric for metric in resp_json['metrics'] if metric['display_name'] == 'Heart Rate'), None)
 
+        # every per sample series as flat numpy arrays
+        import peloton_metrics
+
+        ftp = self.peloton_user.cycling_ftp if self.peloton_user is not None else None
+        self.metrics = peloton_metrics.extract_metrics(self.workout_id, resp_json, ftp=ftp)
+
         # running pace
         self.avg_pace = None
         self.avg_pace_dict = next((summary for summary in resp_json['average_summaries'] if summary['display_name'] == 'Avg Pace'), None)
@@ -140,15 +234,25 @@ class PelotonWorkout:
 
         # best mile
         self.best_mile = None
+        self.splits_dict = None
         if 'splits' in resp_json['splits_data']:
             self.splits_dict = next((splits for splits in resp_json['splits_data']['splits'] if splits['is_best'] == True), None)
 
             if self.splits_dict is not None:
                 self.best_mile = self.splits_dict['seconds'] / 60
 
+        self.hydrated.add('performance_graph')
+
+
+    def to_record(self):
+
+        return WorkoutRecord(*(getattr(self, field) for field in WorkoutRecord._fields))
+
 
     def get_performance_graph_df(self):
 
+        import pandas as pd
+
         output = {
             'workout_id': [],
             'display_name': [],
@@ -181,53 +285,51 @@ class PelotonWorkout:
             return None
 
 
-    def get_bigquery_job_config(self):
-        job_config = bigquery.LoadJobConfig(
-            schema=[
-                bigquery.SchemaField('workout_id', 'STRING'),
-                bigquery.SchemaField('user_id', 'STRING'),
-                bigquery.SchemaField('ride_id', 'STRING'),
-                bigquery.SchemaField('created_at', 'TIMESTAMP'),
-                bigquery.SchemaField('fitness_discipline', 'STRING'),
-                bigquery.SchemaField('total_work_joule', 'FLOAT'),
-                bigquery.SchemaField('total_calories', 'FLOAT'),
-                bigquery.SchemaField('distance_miles', 'FLOAT'),
-                bigquery.SchemaField('average_pace', 'FLOAT'),
-                bigquery.SchemaField('average_speed', 'FLOAT'),
-                bigquery.SchemaField('maximum_speed', 'FLOAT'),
-                bigquery.SchemaField('best_mile', 'FLOAT'),
-                bigquery.SchemaField('average_heart_rate', 'FLOAT'),
-                bigquery.SchemaField('maximum_heart_rate', 'FLOAT'),
-                bigquery.SchemaField('is_total_work_personal_record', 'BOOLEAN'),
-                bigquery.SchemaField('status', 'STRING'),
-            ],
-            write_disposition='WRITE_TRUNCATE'
-        )
-
-        return job_config
+    @classmethod
+    def get_bigquery_job_config(cls, write_disposition='WRITE_TRUNCATE'):
 
+        import peloton_loader
 
-    def to_df(self):
+        return peloton_loader.get_job_config('workouts', write_disposition)
+
+
+    @classmethod
+    def to_columns(cls, workouts):
+
+        # build each column in a single pass, in the order of the workouts schema
         output = {
-            'workout_id': [self.workout_id],
-            'user_id': [self.peloton_user.userid],
-            'ride_id': [self.ride_id],
-            'created_at': [pd.to_datetime(self.created_at_epoch, unit='s')],
-            'fitness_discipline': [self.fitness_discipline.capitalize()],
-            'total_work_joule': [self.total_work_joule],
-            'total_calories': [self.calories],
-            'distance_miles': [self.distance_miles],
-            'average_pace': [self.avg_pace],
-            'average_speed': [self.avg_speed],
-            'maximum_speed': [self.max_speed],
-            'best_mile': [self.best_mile],
-            'average_heart_rate': [self.avg_heart_rate],
-            'maximum_heart_rate': [self.max_heart_rate],
-            'is_total_work_personal_record': [self.is_total_work_personal_record],
-            'status': [self.status],
+            'workout_id': [workout.workout_id for workout in workouts],
+            'user_id': [workout.user_id for workout in workouts],
+            'ride_id': [workout.ride_id for workout in workouts],
+            'created_at': [workout.created_at_epoch for workout in workouts],
+            'fitness_discipline': [workout.fitness_discipline.capitalize() for workout in workouts],
+            'total_work_joule': [workout.total_work_joule for workout in workouts],
+            'total_calories': [workout.calories for workout in workouts],
+            'distance_miles': [workout.distance_miles for workout in workouts],
+            'average_pace': [workout.avg_pace for workout in workouts],
+            'average_speed': [workout.avg_speed for workout in workouts],
+            'maximum_speed': [workout.max_speed for workout in workouts],
+            'best_mile': [workout.best_mile for workout in workouts],
+            'average_heart_rate': [workout.avg_heart_rate for workout in workouts],
+            'maximum_heart_rate': [workout.max_heart_rate for workout in workouts],
+            'is_total_work_personal_record': [workout.is_total_work_personal_record for workout in workouts],
+            'status': [workout.status for workout in workouts],
         }
 
-        df = pd.DataFrame(output)
+        return output
+
+
+    @classmethod
+    def to_frame(cls, workouts):
+
+        import pandas as pd
+
+        df = pd.DataFrame(cls.to_columns(workouts))
+        df['created_at'] = pd.to_datetime(df['created_at'], unit='s')
 
         return df
 
+
+    def to_df(self):
+
+        return self.to_frame([self])